@@ -4,22 +4,192 @@ __version__ = get_versions()['version']
 del get_versions
 
 import os
+import functools
+import inspect
+import threading
+import time
 import numpy as np
 import random
 from pathlib import Path
 import uuid
+from collections import deque
 
 from ophyd import Signal
 from ophyd.sim import SynSignal
+from ophyd.status import DeviceStatus
 from ophyd.areadetector.filestore_mixins import resource_factory
 
 import tifffile
 import h5py
 
+from .images import quantize
+from .writers import get_writer, get_trigger_pool, fsync_path
+from .memstore import MemoryFrameStore, get_store
+from .shmring import SharedFrameRing
+from .procpool import SharedFrameBuffer
+from .streams import device_seed
+
 # Basic signals 
 # TODO: sort out file formats into trigger mixins?
+# classic TIFF addresses at most 4 GiB, leave room for the IFDs
+CLASSIC_TIFF_LIMIT = 2**32 - 2**24
+
 class SynTiffFilestore(SynSignal):
+    """
+    Writes frames to TIFF.
+
+    Parameters
+    ----------
+    tiff_mode : {'point', 'run'}
+        'point' writes one file per trigger, all under a single
+        SSRL_TIFF_SERIES resource set up at stage().  'run' keeps a TiffWriter open from
+        stage() to unstage() and appends each frame as a page, emitting
+        one resource per file and a datum per frame giving its page
+        index.  A num_images stack is appended as consecutive pages in one
+        write, with a datum giving its first page and count, while
+        'point' mode writes it as one multi-page file.  Unstaged triggers
+        fall back to an AD_TIFF resource per file
+    tiff_bigtiff : bool
+        in 'run' mode, write BigTIFF so one file can hold the whole run.
+        Otherwise classic TIFF files roll over to a new file (and
+        resource) before reaching the 4 GiB limit
+    """
+    def __init__(self, *args, tiff_mode='point', tiff_bigtiff=False,
+                 **kwargs):
+        if tiff_mode not in ('point', 'run'):
+            raise ValueError(f'unknown tiff_mode {tiff_mode!r}')
+        self.tiff_mode = tiff_mode
+        self.tiff_bigtiff = tiff_bigtiff
+        self._tiff_staged = False
+        self._tiff_resource = None
+        # writer side, only touched by whoever runs the writes
+        self._tiff_fh = None
+        self._tiff_writer = None
+        super().__init__(*args, **kwargs)
+
+    def stage(self):
+        # everything a trigger needs but the frame is settled once here
+        self._tiff_dir = Path(self.fstore_path) / 'tmp'
+        os.makedirs(self._tiff_dir, exist_ok=True)
+        self._tiff_staged = True
+        self._tiff_resource = None
+        if self.tiff_mode == 'point':
+            self._new_tiff_series()
+        return [self]
+
+    def unstage(self):
+        if self._tiff_staged:
+            self._tiff_staged = False
+            self._tiff_resource = None
+            try:
+                self._wait_for_writes()
+            finally:
+                self._close_tiff_stack()
+        return [self]
+
+    def _new_tiff_series(self):
+        """Set up the resource every point of a run shares"""
+        filename = f'{uuid.uuid4()}'
+        resource, self._tiff_datum_factory = resource_factory(
+                spec='SSRL_TIFF_SERIES',
+                root=Path(self.fstore_path),
+                resource_path=self._tiff_dir,
+                resource_kwargs={'template': '%s%s_%d.tiff',
+                                 'filename': filename},
+                path_semantics='windows')
+        self._tiff_series = resource
+        self._tiff_prefix = os.path.join(self._tiff_dir, filename + '_')
+        self._tiff_points = 0
+
+    def _new_tiff_stack(self, bigtiff):
+        """Start a new multi-page file and its resource"""
+        resource, self._tiff_datum_factory = resource_factory(
+                spec='SSRL_TIFF_STACK',
+                root=Path(self.fstore_path),
+                resource_path=self._tiff_dir / f'{uuid.uuid4()}.tiff',
+                resource_kwargs={},
+                path_semantics='windows')
+        self._tiff_resource = resource
+        self._tiff_path = str(Path(resource['root']) /
+                              resource['resource_path'])
+        self._tiff_bigtiff_file = bigtiff
+        self._tiff_pages = 0
+        self._tiff_bytes = 0
+        self._asset_docs_cache.append(('resource', resource))
+
+    def _append_pages(self, fpath, bigtiff, frames):
+        """Write frames as the next pages of fpath, opening it if new"""
+        if self._tiff_fh is None or self._tiff_fh.name != fpath:
+            self._close_tiff_stack()
+            self._tiff_fh = open(fpath, 'wb')
+            self._tiff_writer = tifffile.TiffWriter(self._tiff_fh,
+                                                    bigtiff=bigtiff)
+        # metadata=None keeps every page a plain, separate image
+        for frame in frames:
+            self._tiff_writer.write(frame, metadata=None)
+        self._tiff_fh.flush()
+        if self.async_write:
+            os.fsync(self._tiff_fh.fileno())
+
+    def _close_tiff_stack(self):
+        if self._tiff_writer is not None:
+            self._tiff_writer.close()
+            self._tiff_fh.close()
+            self._tiff_writer = None
+            self._tiff_fh = None
+
+    def _trigger_stack(self):
+        st = super().trigger()
+        ret = super().read()
+        val = ret[self.name]['value']
+
+        bigtiff = self.tiff_bigtiff or val.nbytes >= CLASSIC_TIFF_LIMIT
+        if (self._tiff_resource is None or
+                (not self._tiff_bigtiff_file and
+                 self._tiff_bytes + val.nbytes > CLASSIC_TIFF_LIMIT)):
+            self._new_tiff_stack(bigtiff)
+        page = self._tiff_pages
+        self._tiff_bytes += val.nbytes
+        if self.num_images is None:
+            self._tiff_pages += 1
+            datum = self._tiff_datum_factory({'page': page})
+            frames = (val,)
+        else:
+            self._tiff_pages += len(val)
+            datum = self._tiff_datum_factory({'page': page,
+                                              'count': len(val)})
+            frames = val
+        self._asset_docs_cache.append(('datum', datum))
+
+        wst = self._write(self._append_pages, self._tiff_path,
+                          self._tiff_bigtiff_file, frames)
+
+        ret[self.name]['value'] = datum['datum_id']
+        self._last_ret = ret
+        return self._join_status(st, wst)
+
+    def _trigger_series(self):
+        st = super().trigger()
+        ret = super().read()
+        if self._tiff_resource is None:
+            self._tiff_resource = self._tiff_series
+            self._asset_docs_cache.append(('resource', self._tiff_series))
+        n = self._tiff_points
+        self._tiff_points += 1
+        datum = self._tiff_datum_factory({'point_number': n})
+        self._asset_docs_cache.append(('datum', datum))
+        wst = self._write(self._write_tiff, f'{self._tiff_prefix}{n}.tiff',
+                          ret[self.name]['value'])
+        ret[self.name]['value'] = datum['datum_id']
+        self._last_ret = ret
+        return self._join_status(st, wst)
+
     def trigger(self):
+        if self._tiff_staged:
+            if self.tiff_mode == 'run':
+                return self._trigger_stack()
+            return self._trigger_series()
+
         # not running at the moment.... but super.trigger() is.  
         tmpRoot = Path(self.fstore_path)
         tmpPath = 'tmp'
@@ -49,15 +219,195 @@ class SynTiffFilestore(SynSignal):
                     + f'_{self.point_number}.tiff')
         fpath = Path(resource['root']) / resource['resource_path'] / fname
         # for tiff spec
-        tifffile.imsave(fpath, val)
+        wst = self._write(self._write_tiff, fpath, val)
         
         # replace 'value' in read dict with some datum id
         ret[self.name]['value'] = datum['datum_id']
         self._last_ret = ret
-        return st
+        return self._join_status(st, wst)
+
+    def _write_tiff(self, fpath, val):
+        with open(fpath, 'wb') as fh:
+            if self.num_images is None:
+                tifffile.imwrite(fh, val)
+            else:
+                # a page per image, like _append_pages
+                with tifffile.TiffWriter(fh) as tif:
+                    for frame in val:
+                        tif.write(frame, metadata=None)
+            if self.async_write:
+                fh.flush()
+                os.fsync(fh.fileno())
 
 class SynHDF5Filestore(SynSignal):
+    """
+    Writes frames to HDF5, under /entry/instrument/detector/data.
+
+    Parameters
+    ----------
+    hdf5_mode : {'point', 'run'}
+        'point' writes a new file per trigger, all under a single
+        SSRL_HDF5_SERIES resource set up at stage().  'run' works like the
+        areaDetector HDF5 plugin: one file is opened at stage(), each frame
+        is appended to a chunked, resizable dataset and one resource is
+        emitted per run, with a datum per frame giving its index.  A
+        num_images stack is appended in one write, one chunk per stack
+        unless hdf5_chunks says otherwise, with a datum giving its first
+        frame and count.  Unstaged triggers fall back to an SSRL_HDF5_FILE
+        resource per file
+    hdf5_chunks : tuple, optional
+        chunk shape.  Given per frame, or with a leading frame axis to
+        group several frames per chunk in 'run' mode.  'run' mode defaults
+        to one frame per chunk, 'point' mode to contiguous storage unless
+        compressed
+    hdf5_compression : {None, 'gzip', 'lzf'}
+        h5py built-in compression filter
+    hdf5_compression_opts : int, optional
+        gzip level, 0-9
+    hdf5_shuffle : bool
+        apply the byte shuffle filter ahead of compression
+    """
+    _h5_key = '/entry/instrument/detector/data'
+
+    def __init__(self, *args, hdf5_mode='point', hdf5_chunks=None,
+                 hdf5_compression=None, hdf5_compression_opts=None,
+                 hdf5_shuffle=False, **kwargs):
+        if hdf5_mode not in ('point', 'run'):
+            raise ValueError(f'unknown hdf5_mode {hdf5_mode!r}')
+        self.hdf5_mode = hdf5_mode
+        self.hdf5_chunks = hdf5_chunks
+        self.hdf5_compression = hdf5_compression
+        self.hdf5_compression_opts = hdf5_compression_opts
+        self.hdf5_shuffle = hdf5_shuffle
+        self._h5_staged = False
+        self._h5_file = None
+        self._h5_datum_factory = None
+        super().__init__(*args, **kwargs)
+
+    def stage(self):
+        # everything a trigger needs but the frame is settled once here
+        tmpRoot = Path(self.fstore_path)
+        self._h5_dir = tmpRoot / 'tmp'
+        os.makedirs(self._h5_dir, exist_ok=True)
+        if self.hdf5_mode == 'run':
+            resource, self._h5_datum_factory = resource_factory(
+                    spec='SSRL_HDF5',
+                    root=tmpRoot,
+                    resource_path=self._h5_dir / f'{uuid.uuid4()}.h5',
+                    resource_kwargs={'key': self._h5_key},
+                    path_semantics='windows')
+            self._h5_file = h5py.File(
+                Path(resource['root']) / resource['resource_path'], 'w')
+        else:
+            filename = f'{uuid.uuid4()}'
+            resource, self._h5_datum_factory = resource_factory(
+                    spec='SSRL_HDF5_SERIES',
+                    root=tmpRoot,
+                    resource_path=self._h5_dir,
+                    resource_kwargs={'template': '%s%s_%d.h5',
+                                     'filename': filename,
+                                     'key': self._h5_key},
+                    path_semantics='windows')
+            self._h5_prefix = os.path.join(self._h5_dir, filename + '_')
+        self._h5_resource = resource
+        self._h5_frames = 0
+        self._h5_staged = True
+        return [self]
+
+    def unstage(self):
+        if self._h5_staged:
+            self._h5_staged = False
+            try:
+                self._wait_for_writes()
+            finally:
+                if self._h5_file is not None:
+                    self._h5_file.close()
+                    self._h5_file = None
+                self._h5_datum_factory = None
+        return [self]
+
+    def _h5_dataset_kwargs(self, frame_shape, stacked=False,
+                           chunk_frames=1):
+        """Storage keyword arguments for create_dataset"""
+        chunks = self.hdf5_chunks
+        if chunks is not None:
+            chunks = tuple(chunks)
+            if stacked and len(chunks) == len(frame_shape):
+                chunks = (chunk_frames,) + chunks
+            elif not stacked and len(chunks) == len(frame_shape) + 1:
+                chunks = chunks[1:]
+            # chunks can't exceed the (fixed) frame dimensions
+            lead = len(chunks) - len(frame_shape)
+            chunks = chunks[:lead] + tuple(
+                min(c, n) for c, n in zip(chunks[lead:], frame_shape))
+        elif stacked:
+            chunks = (chunk_frames,) + frame_shape
+
+        kwargs = {'chunks': chunks}
+        if self.hdf5_compression is not None:
+            kwargs['compression'] = self.hdf5_compression
+            kwargs['compression_opts'] = self.hdf5_compression_opts
+        if self.hdf5_shuffle:
+            kwargs['shuffle'] = True
+        return kwargs
+
+    def _append_frames(self, f, n, frames):
+        """Write a stack of frames from index n of the run file's dataset"""
+        shape = frames.shape[1:]
+        if self._h5_key not in f:
+            # first frames of the run size the dataset
+            f.create_dataset(self._h5_key, shape=(0,) + shape,
+                             maxshape=(None,) + shape, dtype=frames.dtype,
+                             **self._h5_dataset_kwargs(
+                                 shape, stacked=True,
+                                 chunk_frames=len(frames)))
+        dset = f[self._h5_key]
+        dset.resize(n + len(frames), axis=0)
+        dset[n:n + len(frames)] = frames
+        f.flush()
+        if self.async_write:
+            os.fsync(f.id.get_vfd_handle())
+
+    def _write_h5(self, fpath, val):
+        with h5py.File(fpath, 'w') as f:
+            e = f.create_group('/entry/instrument/detector')
+            dset = e.create_dataset('data', data=val,
+                                    **self._h5_dataset_kwargs(val.shape))
+        if self.async_write:
+            fsync_path(fpath)
+
     def trigger(self):
+        if self._h5_staged:
+            st = super().trigger()
+            ret = super().read()
+            val = ret[self.name]['value']
+            # frame indices are handed out here, the dataset grows to fit
+            # as the writes land
+            n = self._h5_frames
+            if n == 0:
+                self._asset_docs_cache.append(('resource',
+                                               self._h5_resource))
+            if self._h5_file is not None:
+                if self.num_images is None:
+                    self._h5_frames += 1
+                    datum = self._h5_datum_factory({'frame': n})
+                    val = val[np.newaxis]
+                else:
+                    self._h5_frames += len(val)
+                    datum = self._h5_datum_factory({'frame': n,
+                                                    'count': len(val)})
+                wst = self._write(self._append_frames, self._h5_file, n,
+                                  val)
+            else:
+                self._h5_frames += 1
+                datum = self._h5_datum_factory({'point_number': n})
+                wst = self._write(self._write_h5, f'{self._h5_prefix}{n}.h5',
+                                  val)
+            self._asset_docs_cache.append(('datum', datum))
+            ret[self.name]['value'] = datum['datum_id']
+            self._last_ret = ret
+            return self._join_status(st, wst)
+
         # not running at the moment.... but super.trigger() is.  
         tmpRoot = Path(self.fstore_path)
         tmpPath = 'tmp'
@@ -71,41 +421,532 @@ class SynHDF5Filestore(SynSignal):
         self.point_number += 1 
         fn = f'{uuid.uuid4()}.h5'
         resource, datum_factory = resource_factory(
-                spec='XSP3',
+                spec='SSRL_HDF5_FILE',
                 root=tmpRoot,
                 resource_path=tmpRoot / tmpPath / fn,
                 resource_kwargs={}, # Handler takes only one 'filename' argument, which is pulled from the... 
                 path_semantics='windows')
         datum = datum_factory({})
-        print(resource)     
         self._asset_docs_cache.append(('resource', resource))
         self._asset_docs_cache.append(('datum', datum))
 
         fpath = Path(resource['root']) / resource['resource_path']
         # for h5 spec
-        with h5py.File(fpath, 'w') as f:
-            e = f.create_group('/entry/instrument/detector')
-            dset = e.create_dataset('data', data=val)
+        wst = self._write(self._write_h5, fpath, val)
         
         # replace 'value' in read dict with some datum id
         ret[self.name]['value'] = datum['datum_id']
         self._last_ret = ret
-        return st
+        return self._join_status(st, wst)
+
+class SynNPYFilestore(SynSignal):
+    """
+    Appends frames to a preallocated, memory-mapped file per run.
+
+    Frames are copied straight into the mapping, with no encoding, and
+    read back as np.memmap views by SynNPYHandler.  A new file (and
+    resource) is started at stage(), or whenever the current one is full.
+
+    Parameters
+    ----------
+    npy_format : {'npy', 'raw'}
+        '.npy' files carry their own dtype and shape header.  'raw' files
+        are bare frame data, with dtype and shape in the resource
+    npy_capacity : int
+        frames preallocated per file
+    """
+    def __init__(self, *args, npy_format='npy', npy_capacity=1000,
+                 **kwargs):
+        if npy_format not in ('npy', 'raw'):
+            raise ValueError(f'unknown npy_format {npy_format!r}')
+        self.npy_format = npy_format
+        self.npy_capacity = npy_capacity
+        self._npy_map = None
+        super().__init__(*args, **kwargs)
+
+    def stage(self):
+        self._close_npy()
+        return [self]
+
+    def unstage(self):
+        try:
+            self._wait_for_writes()
+        finally:
+            self._close_npy()
+        return [self]
+
+    def _new_npy_file(self, val):
+        """Preallocate and map the next file for frames like val"""
+        self._close_npy()
+        tmpRoot = Path(self.fstore_path)
+        tmpPath = 'tmp'
+        os.makedirs(tmpRoot / tmpPath, exist_ok=True)
+        shape = (self.npy_capacity,) + val.shape
+        if self.npy_format == 'npy':
+            fn = f'{uuid.uuid4()}.npy'
+            resource_kwargs = {}
+        else:
+            fn = f'{uuid.uuid4()}.raw'
+            resource_kwargs = {'dtype': val.dtype.str, 'shape': list(shape)}
+        resource, self._npy_datum_factory = resource_factory(
+                spec='SSRL_NPY',
+                root=tmpRoot,
+                resource_path=tmpRoot / tmpPath / fn,
+                resource_kwargs=resource_kwargs,
+                path_semantics='windows')
+        fpath = Path(resource['root']) / resource['resource_path']
+        if self.npy_format == 'npy':
+            self._npy_map = np.lib.format.open_memmap(
+                fpath, mode='w+', dtype=val.dtype, shape=shape)
+        else:
+            self._npy_map = np.memmap(fpath, mode='w+', dtype=val.dtype,
+                                      shape=shape)
+        self._npy_frames = 0
+        self._asset_docs_cache.append(('resource', resource))
+
+    def _store_npy(self, mm, n, val):
+        mm[n] = val
+        if self.async_write:
+            mm.flush()
+
+    def _close_npy(self):
+        if self._npy_map is not None:
+            self._npy_map.flush()
+            self._npy_map = None
+
+    def trigger(self):
+        st = super().trigger()
+        ret = super().read()
+        val = ret[self.name]['value']
+
+        mm = self._npy_map
+        if (mm is None or self._npy_frames == len(mm) or
+                mm.shape[1:] != val.shape or mm.dtype != val.dtype):
+            self._new_npy_file(val)
+            mm = self._npy_map
+        n = self._npy_frames
+        self._npy_frames += 1
+        datum = self._npy_datum_factory({'frame': n})
+        self._asset_docs_cache.append(('datum', datum))
+        wst = self._write(self._store_npy, mm, n, val)
+
+        ret[self.name]['value'] = datum['datum_id']
+        self._last_ret = ret
+        return self._join_status(st, wst)
+
+class FrameRingBuffer:
+    """
+    Fixed pool of preallocated frames, handed out round-robin.
+
+    A slot is only handed out again once it has been released, ie. once
+    the filestore writer has persisted the frame in it, so steady-state
+    acquisition reuses the same memory instead of allocating per trigger.
+
+    Parameters
+    ----------
+    shape : tuple
+        shape of one frame
+    dtype : np.dtype
+        dtype of the frames
+    size : int
+        number of slots
+    """
+    def __init__(self, shape, dtype, size=4):
+        self.frames = np.empty((size,) + tuple(shape), dtype=dtype)
+        self._busy = [False] * size
+        self._next = 0
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        return len(self.frames)
+
+    def acquire(self, timeout=10):
+        """
+        Claim the next slot, waiting for it to be released if the writer
+        is behind.
+
+        Returns
+        -------
+            int, slot index
+        """
+        with self._cond:
+            slot = self._next
+            if not self._cond.wait_for(lambda: not self._busy[slot],
+                                       timeout=timeout):
+                raise RuntimeError(f'frame slot {slot} was not released '
+                                   f'within {timeout} s')
+            self._busy[slot] = True
+            self._next = (slot + 1) % len(self.frames)
+            return slot
+
+    def release(self, slot):
+        """Mark a slot as persisted, free for reuse"""
+        with self._cond:
+            self._busy[slot] = False
+            self._cond.notify_all()
+
 
 class ArraySynSignal(SynSignal):
     """
     Base class for synthetic array signals. 
     Same interface as a normal ArraySignal, but with simulated data and 
     filestore
+
+    Parameters
+    ----------
+    fstore_path : Path or str
+        root directory files are written under
+    dtype : np.dtype or str, optional
+        dtype frames are stored as, eg. 'float32', 'uint16', 'uint32'.
+        Defaults to whatever func returns
+    scale : float, optional
+        counts per unit of func's output, applied before noise and
+        quantizing to dtype
+    noise : ssrlsim.images.DetectorNoise, optional
+        noise stage applied to every frame, in counts
+    ring_size : int, optional
+        number of preallocated frames to cycle through.  Frames are
+        generated into a slot, which is free for reuse once the filestore
+        has written it, or once the trigger is done if nothing stores it;
+        the value read back from the signal is only valid until the ring
+        comes round to it again.  0 or None allocates a new frame per
+        trigger
+    async_write : bool, optional
+        write frames on the shared background writer thread.  trigger()
+        then returns a status that completes once the frame has been
+        written and fsync'd, or fails with the write's error
+    asset_docs_high_water : int, optional
+        most asset documents held waiting for collect_asset_docs(), a hard
+        limit: past it trigger() raises straight away.  The RunEngine
+        collects them from the thread that triggers, so waiting for it
+        would only stall
+    backend : {'file', 'memory', 'shm'}
+        'file' stores frames through the filestore mixin.  'memory' skips
+        it and the filesystem altogether: frames go into memory_store
+        under their datum_id, one SSRL_MEMORY resource per run.  'shm'
+        copies frames into a shared memory ring other processes can map,
+        one SSRL_SHM resource per run and a datum per frame giving its
+        slot and sequence number
+    memory_store : str or ssrlsim.memstore.MemoryFrameStore, optional
+        store, or name of the store, the 'memory' backend puts frames in
+    memory_max_bytes : int, optional
+        size cap for memory_store, least recently used frames are evicted
+        past it
+    shm_size : int, optional
+        slots in the shared memory ring
+    shm_wait : float, optional
+        seconds to wait for consumers to release a slot before it is
+        reused, then fail the trigger.  None reuses slots regardless, so
+        slow consumers find their frame gone
+    threaded_trigger : bool, optional
+        generate and store frames on the shared trigger thread pool.
+        trigger() then returns straight away with a status that completes
+        once the frame is stored, so detectors triggered together work in
+        parallel.  Triggers of one detector still run one at a time
+    engine : {'thread', 'process'}
+        where func runs.  'thread' calls it in whichever thread triggers,
+        'process' on the shared process pool (ssrlsim.procpool), rendering
+        into a shared memory buffer so frames are never pickled.  func and
+        its arguments must then be picklable.  Scaling, noise and storage
+        stay in this process either way
+    seed : int or np.random.SeedSequence, optional
+        seed for this detector's stream, the next device stream from
+        ssrlsim.streams otherwise.  Each frame spawns its own child of it,
+        handed to func as rng if func takes one and used for the frame's
+        noise, so frames don't depend on where or in what batch they are
+        rendered
+    fly_period : float, optional
+        seconds between frames when flown, see kickoff()
+    fly_frames : int, optional
+        frames to take when flown.  None keeps going until complete()
+    num_images : int, optional
+        images taken per trigger, like a detector's NumImages.  The
+        value is then a (num_images, ...) stack, rendered in one batched
+        call if func takes num_images, or by calling func once per image
+        otherwise.  Either way image i comes out the same as the i-th of
+        num_images single triggers would.  The filestores write the stack
+        in one go, under one datum addressing the range of frames.  None
+        takes single frames, without the leading axis
     """
-    _asset_docs_cache = []
     _last_ret = None
     point_number = 0
+    _ring = None
+    _frame_shape = None
+    _slot = None
+    _pending_write = None
+    _pending_trigger = None
 
-    def __init__(self, fstore_path=None, *args, **kwargs):
+    def __init__(self, fstore_path=None, *args, dtype=None, scale=1.0,
+                 noise=None, ring_size=4, async_write=False,
+                 asset_docs_high_water=1000, backend='file',
+                 memory_store='default',
+                 memory_max_bytes=None, shm_size=8, shm_wait=None,
+                 threaded_trigger=False, engine='thread', seed=None,
+                 fly_period=0.1, fly_frames=None, num_images=None,
+                 **kwargs):
+        if backend not in ('file', 'memory', 'shm'):
+            raise ValueError(f'unknown backend {backend!r}')
+        if engine not in ('thread', 'process'):
+            raise ValueError(f'unknown engine {engine!r}')
+        self.engine = engine
+        self._proc_buffer = None
+        self.num_images = num_images
+        if seed is None:
+            seed = device_seed()
+        elif not isinstance(seed, np.random.SeedSequence):
+            seed = np.random.SeedSequence(seed)
+        self._seed_seq = seed
+        self.fly_period = fly_period
+        self.fly_frames = fly_frames
+        self._fly_thread = None
+        self._fly_events = []
+        self.backend = backend
+        if not isinstance(memory_store, MemoryFrameStore):
+            memory_store = get_store(memory_store, max_bytes=memory_max_bytes)
+        elif memory_max_bytes is not None:
+            memory_store.max_bytes = memory_max_bytes
+        self.memory_store = memory_store
+        self.shm_size = shm_size
+        self.shm_wait = shm_wait
+        self._shm_ring = None
+        self._mem_resource = None
+        self.threaded_trigger = threaded_trigger
+        self._trigger_lock = threading.Lock()
+        self._asset_docs_cache = deque()
+        self.asset_docs_high_water = asset_docs_high_water
         self.fstore_path = fstore_path
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.scale = scale
+        self.noise = noise
+        self.ring_size = ring_size
+        self.async_write = async_write
         super(ArraySynSignal, self).__init__(*args, **kwargs)
-    
+
+    # SynSignal triggers by calling self._func().  Keep the user's function
+    # aside and hand SynSignal _make_frame instead, so every frame passes
+    # through the detector's scaling, noise and conversion stages.
+    @property
+    def _func(self):
+        return self._make_frame
+
+    @_func.setter
+    def _func(self, func):
+        self._frame_func = func
+        params = inspect.signature(func).parameters.values()
+        if any(p.kind == p.VAR_KEYWORD for p in params):
+            self._frame_func_params = None  # takes anything
+        else:
+            self._frame_func_params = {p.name for p in params}
+
+    @property
+    def num_images(self):
+        return self._num_images
+
+    @num_images.setter
+    def num_images(self, num_images):
+        if num_images is not None and num_images < 1:
+            raise ValueError(f'num_images must be at least 1, '
+                             f'not {num_images}')
+        self._num_images = num_images
+        # the value changes shape, so the next frame sizes the ring and
+        # buffers afresh
+        self._frame_shape = None
+        self._ring = None
+        self._close_proc_buffer()
+
+    def _frame_kwargs(self):
+        """
+        Detector settings offered to func as keyword arguments.  Only the
+        ones func's signature accepts are passed, so plain ``func()``
+        functions keep working.
+        """
+        return {}
+
+    def _call_func(self, **extra):
+        kwargs = self._frame_kwargs()
+        kwargs.update(extra)
+        func = self._frame_func
+        params = self._frame_func_params
+        if self.num_images is not None:
+            if params is None or 'num_images' in params:
+                kwargs['num_images'] = self.num_images
+            else:
+                # func renders one image per call, stack them up
+                func = functools.partial(_stack_frames, func,
+                                         self.num_images)
+        if params is not None:
+            kwargs = {k: v for k, v in kwargs.items() if k in params}
+        if self._proc_buffer is not None:
+            if 'out' in kwargs:
+                kwargs['out'] = None  # the worker points it at the buffer
+            return self._proc_buffer.call(func, kwargs)
+        return func(**kwargs)
+
+    def _frame_rngs(self):
+        """
+        The next frame's streams, for func and for noise.  A stack takes
+        the next num_images frames' streams, as lists.
+        """
+        if self.num_images is None:
+            frame_seq, = self._seed_seq.spawn(1)
+            return [np.random.default_rng(s) for s in frame_seq.spawn(2)]
+        streams = [[np.random.default_rng(s) for s in frame_seq.spawn(2)]
+                   for frame_seq in self._seed_seq.spawn(self.num_images)]
+        return [list(images) for images in zip(*streams)]
+
+    def _convert(self, frame, out=None, rng=None, owned=False):
+        """
+        Scale, add noise and quantize a raw frame from func.  Only an owned
+        frame, one of the detector's own buffers, is worked on in place.
+        """
+        if self.dtype is None and self.noise is None and self.scale == 1:
+            if out is not None and frame is not out:
+                np.copyto(out, frame)
+                return out
+            return frame
+
+        if owned:
+            frame = np.asarray(frame, dtype=float)
+        else:
+            # func may hand back an array it keeps, leave that be
+            frame = np.array(frame, dtype=float)
+        if self.scale != 1:
+            frame *= self.scale
+        if self.noise is not None:
+            if isinstance(rng, list):
+                # a stack, each image with its own noise
+                for image, image_rng in zip(frame, rng):
+                    self.noise.apply(image, rng=image_rng)
+            else:
+                self.noise.apply(frame, rng=rng)
+        if self.dtype is not None:
+            return quantize(frame, self.dtype, out=out)
+        if out is not None and frame is not out:
+            np.copyto(out, frame)
+            return out
+        return frame
+
+    def _make_frame(self):
+        rng, noise_rng = self._frame_rngs()
+        if self._frame_shape is None:
+            # the first frame, rendered here, sizes the ring and buffers
+            frame = np.asarray(self._convert(self._call_func(rng=rng),
+                                             rng=noise_rng))
+            self._frame_shape = frame.shape
+            if self.ring_size:
+                self._ring = FrameRingBuffer(frame.shape, frame.dtype,
+                                             size=self.ring_size)
+                # float scratch for funcs to render into ahead of
+                # conversion, unless they can render straight into a slot
+                if frame.dtype != float:
+                    self._work = np.empty(frame.shape)
+                else:
+                    self._work = None
+            return frame
+
+        if self.engine == 'process' and self._proc_buffer is None:
+            self._proc_buffer = SharedFrameBuffer(self._frame_shape)
+        if self._ring is None:
+            if self._proc_buffer is None:
+                return self._convert(self._call_func(rng=rng), rng=noise_rng)
+            # no ring to convert into, and the buffer gets reused
+            return self._convert(self._call_func(out=None, rng=rng).copy(),
+                                 rng=noise_rng, owned=True)
+
+        slot = self._ring.acquire()
+        target = self._ring.frames[slot]
+        if self._proc_buffer is not None:
+            work = None  # the worker renders into the shared buffer
+            buffer = self._proc_buffer.array
+        elif self._work is None:
+            work = buffer = target
+        else:
+            work = buffer = self._work
+        try:
+            raw = self._call_func(out=work, rng=rng)
+            frame = self._convert(raw, out=target, rng=noise_rng,
+                                  owned=raw is buffer)
+        except BaseException:
+            # no frame, nothing to write
+            self._ring.release(slot)
+            raise
+        self._slot = slot
+        return frame
+
+    def _write(self, write, *args):
+        """
+        Persist the frame just generated with write(*args), on the
+        background writer if async_write, then hand its slot back to the
+        ring.
+
+        Returns
+        -------
+            DeviceStatus, done once the write is
+        """
+        slot, self._slot = self._slot, None
+        ring = self._ring
+
+        def job():
+            try:
+                write(*args)
+            finally:
+                if slot is not None:
+                    ring.release(slot)
+
+        status = DeviceStatus(device=self)
+        if self.async_write:
+            self._pending_write = get_writer().submit(job, status=status)
+        else:
+            job()
+            status.set_finished()
+        return status
+
+    def _release_slot(self):
+        """Hand back a slot no write has taken charge of"""
+        slot, self._slot = self._slot, None
+        if slot is not None and self._ring is not None:
+            self._ring.release(slot)
+
+    def _join_status(self, *statuses):
+        """
+        A status done once all of statuses are.  Unlike AndStatus, it fails
+        with the failed status' own exception, eg. the write's, rather than
+        a bare UnknownStatusFailure.
+        """
+        status = DeviceStatus(device=self)
+        pending = list(statuses)
+        lock = threading.Lock()
+
+        def finished(st):
+            with lock:
+                if status.done:
+                    return
+                if not st.success:
+                    status.set_exception(st.exception() or RuntimeError(
+                        f'{self.name} failed to store its frame'))
+                    return
+                pending.remove(st)
+                if pending:
+                    return
+                status.set_finished()
+
+        for st in statuses:
+            st.add_callback(finished)
+        return status
+
+    def _wait_for_writes(self):
+        """Block until this detector's triggers and queued writes are done"""
+        if self._pending_trigger is not None:
+            st, self._pending_trigger = self._pending_trigger, None
+            st.wait()
+        self._flush_writes()
+
+    def _flush_writes(self):
+        # the writer is FIFO, so the last write finishing covers the rest
+        if self._pending_write is not None:
+            st, self._pending_write = self._pending_write, None
+            st.wait()
+
     def describe(self):
         ret = super().describe()
         ret[self.name]['external'] = 'FILESTORE:'
@@ -131,12 +972,261 @@ class ArraySynSignal(SynSignal):
             # return {self.name: {'value': self.get(),
             #                      'timestamp': self.timestamp}}
 
+    def stage(self):
+        if self.backend != 'file':
+            self._mem_resource = None
+            return [self]
+        return super().stage()
+
+    def unstage(self):
+        try:
+            if self.backend != 'file':
+                try:
+                    self._wait_for_writes()
+                finally:
+                    self._mem_resource = None
+                return [self]
+            return super().unstage()
+        finally:
+            # set up again by the next frame
+            self._close_proc_buffer()
+
+    def _close_proc_buffer(self):
+        if self._proc_buffer is not None:
+            self._proc_buffer.close()
+            self._proc_buffer = None
+
+    def _new_memory_resource(self):
+        resource, self._mem_datum_factory = resource_factory(
+                spec='SSRL_MEMORY',
+                root='',
+                resource_path=self.memory_store.name,
+                resource_kwargs={},
+                path_semantics='posix')
+        # datum_ids are '<resource uid>/<n>', the handler rebuilds them
+        resource['resource_kwargs']['resource'] = resource['uid']
+        return resource
+
+    def _new_shm_resource(self, val):
+        ring = self._shm_ring
+        if (ring is None or ring.shape != val.shape or
+                ring.dtype != val.dtype):
+            if ring is not None:
+                # called mid-trigger, so only the writes can be waited on
+                self._flush_writes()
+                ring.close()
+            ring = self._shm_ring = SharedFrameRing(val.shape, val.dtype,
+                                                    size=self.shm_size)
+        resource, self._mem_datum_factory = resource_factory(
+                spec='SSRL_SHM',
+                root='',
+                resource_path=ring.name,
+                resource_kwargs={'shape': list(ring.shape),
+                                 'dtype': ring.dtype.str,
+                                 'size': ring.size},
+                path_semantics='posix')
+        return resource
+
+    def _close_shm_ring(self):
+        if self._shm_ring is not None:
+            self._wait_for_writes()
+            self._shm_ring.close()
+            self._shm_ring = None
+
+    def _trigger_memory(self):
+        # bypasses the filestore mixin, straight to SynSignal
+        st = SynSignal.trigger(self)
+        ret = SynSignal.read(self)
+        val = ret[self.name]['value']
+        if self.backend == 'shm':
+            val = np.asarray(val)
+            ring = self._shm_ring
+            if (self._mem_resource is None or ring.shape != val.shape or
+                    ring.dtype != val.dtype):
+                self._mem_resource = self._new_shm_resource(val)
+                self._asset_docs_cache.append(('resource',
+                                               self._mem_resource))
+            slot, seq = self._shm_ring.claim()
+            datum = self._mem_datum_factory({'slot': slot, 'seq': seq})
+            wst = self._write(self._shm_ring.put, slot, seq, val,
+                              self.shm_wait)
+        else:
+            if self._mem_resource is None:
+                self._mem_resource = self._new_memory_resource()
+                self._mem_frames = 0
+                self._asset_docs_cache.append(('resource',
+                                               self._mem_resource))
+            datum = self._mem_datum_factory({'frame': self._mem_frames})
+            self._mem_frames += 1
+            wst = self._write(self.memory_store.put, datum['datum_id'], val)
+        self._asset_docs_cache.append(('datum', datum))
+        ret[self.name]['value'] = datum['datum_id']
+        self._last_ret = ret
+        return self._join_status(st, wst)
+
+    def destroy(self):
+        self._close_shm_ring()
+        self._close_proc_buffer()
+        super().destroy()
+
+    def trigger(self):
+        # don't pile up documents nobody is collecting
+        if len(self._asset_docs_cache) >= self.asset_docs_high_water:
+            raise RuntimeError(
+                f'{self.name} has {len(self._asset_docs_cache)} asset '
+                'documents waiting for collect_asset_docs()')
+        if not self.threaded_trigger:
+            return self._trigger()
+
+        status = DeviceStatus(device=self)
+
+        def finish(inner):
+            if inner.success:
+                status.set_finished()
+            else:
+                status.set_exception(inner.exception() or RuntimeError(
+                    f'{self.name} failed to store its frame'))
+
+        def job():
+            try:
+                with self._trigger_lock:
+                    inner = self._trigger()
+            except Exception as exc:
+                status.set_exception(exc)
+            else:
+                inner.add_callback(finish)
+
+        self._pending_trigger = status
+        get_trigger_pool().submit(job)
+        return status
+
+    def _trigger(self):
+        """Generate a frame and store it through the backend"""
+        try:
+            if self.backend != 'file':
+                return self._trigger_memory()
+            return super().trigger()
+        finally:
+            # without a filestore, or if storing failed before the write,
+            # nothing else releases the frame's slot
+            self._release_slot()
+
+    # Flyer interface: frames are taken on a timer in the background,
+    # stored like triggered frames, and handed to the RunEngine in bulk at
+    # collect(), as one event page
+    def kickoff(self):
+        """
+        Start taking a frame every fly_period seconds, for fly_frames
+        frames or until complete().
+
+        Returns
+        -------
+            DeviceStatus, done once the first frame is under way
+        """
+        if self._fly_thread is not None:
+            raise RuntimeError(f'{self.name} is already flying')
+        self._fly_events = []
+        self._fly_stop = threading.Event()
+        self._fly_status = DeviceStatus(device=self)
+        started = DeviceStatus(device=self)
+        self._fly_thread = threading.Thread(target=self._fly,
+                                            args=(started,),
+                                            name=f'{self.name}-fly',
+                                            daemon=True)
+        self._fly_thread.start()
+        return started
+
+    def _fly(self, started):
+        statuses = []
+        try:
+            start = time.monotonic()
+            started.set_finished()
+            while self.fly_frames is None or len(statuses) < self.fly_frames:
+                delay = (start + len(statuses) * self.fly_period -
+                         time.monotonic())
+                if self._fly_stop.wait(max(delay, 0)):
+                    break
+                with self._trigger_lock:
+                    statuses.append(self._trigger())
+                self._fly_events.append((time.time(),
+                                         self._last_ret[self.name]['value']))
+            # every frame has to be stored, not just the last: raises the
+            # first failed frame's exception
+            for st in statuses:
+                st.wait()
+        except Exception as exc:
+            if not started.done:
+                started.set_exception(exc)
+            self._fly_status.set_exception(exc)
+        else:
+            self._fly_status.set_finished()
+
+    def complete(self):
+        """
+        Stop flying, if fly_frames is None, else wait for the last frame.
+
+        Returns
+        -------
+            DeviceStatus, done once every frame is stored
+        """
+        if self._fly_thread is None:
+            raise RuntimeError(f'{self.name} has not been kicked off')
+        if self.fly_frames is None:
+            self._fly_stop.set()
+        return self._fly_status
+
+    def describe_collect(self):
+        return {self.name: self.describe()}
+
+    def collect(self):
+        """
+        The frames taken since kickoff(), as events.  bluesky packs them
+        into one event page, keeping the filled flags databroker needs to
+        fill them in through the handlers.
+        """
+        if self._fly_thread is not None:
+            if self.fly_frames is None and not self._fly_stop.is_set():
+                raise RuntimeError(f'{self.name} is still flying, '
+                                   'complete() it before collect()')
+            self._fly_thread.join()
+            self._fly_thread = None
+        events, self._fly_events = self._fly_events, []
+        for t, value in events:
+            yield {'time': t,
+                   'data': {self.name: value},
+                   'timestamps': {self.name: t},
+                   'filled': {self.name: False}}
+
     def collect_asset_docs(self):
-        items = list(self._asset_docs_cache)
-        self._asset_docs_cache.clear()
+        items = []
+        while self._asset_docs_cache:
+            items.append(self._asset_docs_cache.popleft())
         for item in items:
             yield item
 
+
+def _stack_frames(func, num_images, **kwargs):
+    """
+    Render a num_images stack with a func that takes one image per call,
+    each image from its own rng and into its own row of out, if func
+    takes them.
+    """
+    rngs = kwargs.pop('rng', None)
+    out = kwargs.pop('out', None)
+    images = []
+    for i in range(num_images):
+        if rngs is not None:
+            kwargs['rng'] = rngs[i]
+        if out is not None:
+            kwargs['out'] = out[i]
+        images.append(func(**kwargs))
+    if out is None:
+        return np.stack(images)
+    for row, image in zip(out, images):
+        if image is not row:
+            row[...] = image
+    return out
+
 # position generator
 def gen_wafer_locs(shape='circle', radius=10):
     """
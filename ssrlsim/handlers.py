@@ -0,0 +1,371 @@
+'''
+Databroker handlers for the filestore specs the simulated detectors write.
+
+Register them with a Broker before reading back data:
+
+    from ssrlsim.handlers import register_handlers
+    register_handlers(db)
+
+The file handlers keep their files open across the datums of a resource,
+and uncompressed TIFF pages come back as np.memmap views, so nothing is
+decoded until it is used.  With register_handlers(db, lazy=True), HDF5 and
+compressed TIFF frames come back as LazyFrame, read only when converted
+to an array or indexed, and then only the indexed part.
+
+Every spec here is the simulator's own.  The AD_TIFF files unstaged TIFF
+triggers write are left to the areaDetector handler the Broker has.
+'''
+import os
+from collections import OrderedDict
+
+import h5py
+import numpy as np
+import tifffile
+
+from .memstore import get_store
+from .shmring import SharedFrameRing
+
+H5_KEY = '/entry/instrument/detector/data'
+
+# files held open at once by the handlers for one-file-per-point specs
+OPEN_FILES = 16
+
+
+class LazyFrame:
+    """
+    A frame, or stack of frames, read from file only when used.
+    Indexing reads just the selected part, np.asarray() the whole thing.
+
+    Parameters
+    ----------
+    read : callable
+        read(key) returns the frame indexed by key, () for all of it
+    shape : tuple
+    dtype : np.dtype
+    """
+    def __init__(self, read, shape, dtype):
+        self._read = read
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return self._read(key if isinstance(key, tuple) else (key,))
+
+    def __array__(self, dtype=None, copy=None):
+        frame = self._read(())
+        return frame if dtype is None else frame.astype(dtype, copy=False)
+
+    def read(self):
+        """The whole frame as an array"""
+        return np.asarray(self)
+
+    def __repr__(self):
+        return f'LazyFrame(shape={self.shape}, dtype={self.dtype})'
+
+
+def _frames(dset, index, lazy):
+    """
+    dset[index], read now or, if lazy, as a LazyFrame.  index is a tuple,
+    () for the whole dataset.
+    """
+    if not lazy:
+        return dset[index]
+    shape = np.empty(dset.shape[:len(index)], dtype=bool)[index].shape
+    return LazyFrame(lambda key: dset[index + key],
+                     shape + dset.shape[len(index):], dset.dtype)
+
+
+def _frame_index(frame, count):
+    return (frame,) if count is None else (slice(frame, frame + count),)
+
+
+def _page(tif, page, lazy):
+    """A TIFF page as a memmap view if it's stored plain, else decoded"""
+    if page.is_memmappable:
+        return tif.filehandle.memmap_array(
+            page.dtype.newbyteorder(tif.byteorder), page.shape,
+            page.dataoffsets[0])
+    if lazy:
+        return LazyFrame(lambda key: page.asarray()[key], page.shape,
+                         page.dtype)
+    return page.asarray()
+
+
+class _OpenFiles:
+    """Least recently used cache of open files, closed on eviction"""
+    def __init__(self, open_file, size=OPEN_FILES):
+        self._open = open_file
+        self._size = size
+        self._files = OrderedDict()
+
+    def __getitem__(self, fname):
+        f = self._files.get(fname)
+        if f is None:
+            f = self._files[fname] = self._open(fname)
+            while len(self._files) > self._size:
+                self._files.popitem(last=False)[1].close()
+        else:
+            self._files.move_to_end(fname)
+        return f
+
+    def close(self):
+        while self._files:
+            self._files.popitem()[1].close()
+
+
+class SynHDF5Handler:
+    """
+    Reads frames from the run-scoped HDF5 files SynHDF5Filestore writes in
+    hdf5_mode='run'.  The file stays open across datums of one resource.
+    A datum with a count reads that many frames on from frame.
+    """
+    specs = {'SSRL_HDF5'}
+    lazy = False
+
+    def __init__(self, filename, key=H5_KEY):
+        self._filename = filename
+        self._key = key
+        self._file = h5py.File(filename, 'r')
+
+    def __call__(self, frame, count=None):
+        return _frames(self._file[self._key], _frame_index(frame, count),
+                       self.lazy)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_file_list(self, datum_kwargs):
+        return [self._filename]
+
+
+class SynHDF5SeriesHandler:
+    """
+    Reads the one-file-per-point HDF5 files SynHDF5Filestore writes in
+    hdf5_mode='point', named like AD_TIFF files from a template.  The most
+    recently read files stay open.
+    """
+    specs = {'SSRL_HDF5_SERIES'}
+    lazy = False
+
+    def __init__(self, fpath, template, filename, key=H5_KEY):
+        self._path = os.path.join(fpath, '')
+        self._template = template
+        self._filename = filename
+        self._key = key
+        self._files = _OpenFiles(lambda fname: h5py.File(fname, 'r'))
+
+    def _fname(self, point_number):
+        return self._template % (self._path, self._filename, point_number)
+
+    def __call__(self, point_number):
+        dset = self._files[self._fname(point_number)][self._key]
+        return _frames(dset, (), self.lazy)
+
+    def close(self):
+        self._files.close()
+
+    def get_file_list(self, datum_kwargs):
+        return [self._fname(**kw) for kw in datum_kwargs]
+
+
+class SynHDF5FileHandler:
+    """
+    Reads the single-frame HDF5 files unstaged SynHDF5Filestore triggers
+    write, one file per resource.
+    """
+    specs = {'SSRL_HDF5_FILE'}
+    lazy = False
+
+    def __init__(self, filename, key=H5_KEY):
+        self._filename = filename
+        self._key = key
+        self._file = h5py.File(filename, 'r')
+
+    def __call__(self):
+        return _frames(self._file[self._key], (), self.lazy)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def get_file_list(self, datum_kwargs):
+        return [self._filename]
+
+
+class SynTiffHandler:
+    """
+    Reads the one-file-per-point TIFFs SynTiffFilestore writes in
+    tiff_mode='point', named from an AD_TIFF style template.  Unlike the
+    areaDetector handler, a point of one frame comes back as that frame,
+    the shape the detector describes, rather than a stack of one.  A file
+    of several pages, a num_images stack, comes back as a stack of them.
+    """
+    specs = {'SSRL_TIFF_SERIES'}
+    lazy = False
+
+    def __init__(self, fpath, template, filename, frame_per_point=1):
+        self._path = os.path.join(fpath, '')
+        self._template = template
+        self._filename = filename
+        self._fpp = frame_per_point
+        self._files = _OpenFiles(tifffile.TiffFile)
+
+    def _fnames(self, point_number):
+        start = point_number * self._fpp
+        return [self._template % (self._path, self._filename, n)
+                for n in range(start, start + self._fpp)]
+
+    def _read(self, fname):
+        tif = self._files[fname]
+        if len(tif.pages) == 1:
+            return _page(tif, tif.pages[0], self.lazy)
+        return np.stack([_page(tif, page, False) for page in tif.pages])
+
+    def __call__(self, point_number):
+        frames = [self._read(fname) for fname in self._fnames(point_number)]
+        if self._fpp == 1:
+            return frames[0]
+        return np.stack(frames)
+
+    def close(self):
+        self._files.close()
+
+    def get_file_list(self, datum_kwargs):
+        return [fname for kw in datum_kwargs for fname in self._fnames(**kw)]
+
+
+class SynTiffStackHandler:
+    """
+    Reads pages from the multi-page TIFF files SynTiffFilestore writes in
+    tiff_mode='run'.  The file stays open across datums of one resource,
+    and tifffile keeps the page offsets it has walked, so each datum is a
+    seek to its page.  Uncompressed pages map straight out of the file.
+    A datum with a count reads that many pages on from page, as a stack.
+    """
+    specs = {'SSRL_TIFF_STACK'}
+    lazy = False
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._tif = tifffile.TiffFile(filename)
+
+    def __call__(self, page, count=None):
+        if count is None:
+            return _page(self._tif, self._tif.pages[page], self.lazy)
+        return np.stack([_page(self._tif, self._tif.pages[n], False)
+                         for n in range(page, page + count)])
+
+    def close(self):
+        if self._tif is not None:
+            self._tif.close()
+            self._tif = None
+
+    def get_file_list(self, datum_kwargs):
+        return [self._filename]
+
+
+class SynNPYHandler:
+    """
+    Maps the .npy/raw files SynNPYFilestore writes.  Frames come back as
+    np.memmap views into the file: no copy and no decode.
+    """
+    specs = {'SSRL_NPY'}
+
+    def __init__(self, filename, dtype=None, shape=None):
+        self._filename = filename
+        if dtype is None:
+            self._map = np.load(filename, mmap_mode='r')
+        else:
+            self._map = np.memmap(filename, mode='r', dtype=np.dtype(dtype),
+                                  shape=tuple(shape))
+
+    def __call__(self, frame):
+        return self._map[frame]
+
+    def close(self):
+        self._map = None
+
+    def get_file_list(self, datum_kwargs):
+        return [self._filename]
+
+
+class SynMemoryHandler:
+    """
+    Reads frames the 'memory' backend put in a MemoryFrameStore.  Only
+    works in the process that took the data, and only until the frames
+    are evicted.
+    """
+    specs = {'SSRL_MEMORY'}
+
+    def __init__(self, store, resource):
+        self._store = get_store(store)
+        self._resource = resource
+
+    def __call__(self, frame):
+        return self._store.get(f'{self._resource}/{frame}')
+
+    def close(self):
+        pass
+
+    def get_file_list(self, datum_kwargs):
+        return []
+
+
+class SynSharedMemoryHandler:
+    """
+    Maps the shared memory ring the 'shm' backend writes into, from any
+    process on the same host.  Frames come back as read-only views into
+    the ring: no copy.  Call release() once done with a frame, which lets
+    a detector waiting on its consumers (shm_wait) reuse the slot.
+    """
+    specs = {'SSRL_SHM'}
+
+    def __init__(self, name, shape, dtype, size):
+        self._ring = SharedFrameRing(shape, dtype, size=size,
+                                     name=name.lstrip('/'), create=False)
+
+    def __call__(self, slot, seq):
+        return self._ring.get(slot, seq)
+
+    def release(self, slot, seq):
+        self._ring.release(slot, seq)
+
+    def close(self):
+        self._ring.close()
+
+    def get_file_list(self, datum_kwargs):
+        return []
+
+
+HANDLERS = [SynHDF5Handler, SynHDF5SeriesHandler, SynHDF5FileHandler,
+            SynTiffHandler, SynTiffStackHandler, SynNPYHandler,
+            SynMemoryHandler, SynSharedMemoryHandler]
+
+
+def register_handlers(db, overwrite=True, lazy=False):
+    """
+    Register every ssrlsim handler with a (v1) databroker Broker
+
+    Parameters
+    ----------
+    db : databroker.Broker
+    overwrite : bool
+        replace handlers already registered for the same specs
+    lazy : bool
+        hand back HDF5 and compressed TIFF frames as LazyFrame
+    """
+    for handler in HANDLERS:
+        if lazy and hasattr(handler, 'lazy'):
+            handler = type(handler.__name__, (handler,), {'lazy': True})
+        for spec in handler.specs:
+            db.reg.register_handler(spec, handler, overwrite=overwrite)
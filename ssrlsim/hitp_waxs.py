@@ -32,7 +32,10 @@ from ophyd.sim import SynAxis
 import bluesky.plan_stubs as bps
 
 from . import ArraySynSignal, gen_wafer_locs, SynTiffFilestore, SynHDF5Filestore
-from .images import make_random_peaks, generate_image
+from .handlers import register_handlers
+from .images import (DetectorNoise, DetectorGeometry, dex_x, dex_func,
+                     xsp3_x, xsp3_func)
+from .streams import device_rng
 
 # initialize RunEngine, temp databroker
 from ssrlsim.scripts.start_RE import *
@@ -43,9 +46,11 @@ class SynLaserRangeFinder(Signal):
     """SynLaserRangeFinder simulates height sensor.  
     
     Represents stage as perfectly flat with 4 randomly initialized heights at 
-    cardinal directions.  
+    cardinal directions, drawn from rng (a Generator or seed), or the next
+    device stream.
     """
-    def __init__(self, stage_x, stage_y, plate_x, plate_y, *args, **kwargs):
+    def __init__(self, stage_x, stage_y, plate_x, plate_y, *args, rng=None,
+                 **kwargs):
         self.stage_x = stage_x # should be ophyd SynAxis's
         self.stage_y = stage_y
         self.plate_x = plate_x
@@ -59,8 +64,9 @@ class SynLaserRangeFinder(Signal):
         
         # initial heights, could be different from motor readouts
         # located at x_max and y_max, with x_min/y_min at 0
-        self.real_plate_x = int(np.random.uniform(200, 500)) * np.random.choice([-1, 1])
-        self.real_plate_y = int(np.random.uniform(20, 500)) * np.random.choice([-1, 1])
+        rng = device_rng(rng)
+        self.real_plate_x = int(rng.uniform(200, 500)) * rng.choice([-1, 1])
+        self.real_plate_y = int(rng.uniform(20, 500)) * rng.choice([-1, 1])
 
         # Sample footprint.  wafer thicknes = 0.5mm = 1.07V
         # spike to 10 after off stage
@@ -145,9 +151,9 @@ I0 = SynAxis(name='I0', value=1)
 
 
 class SynBeamStopDetector(Signal):
-    def __init__(self, motor_z, I = 5, *args, **kwargs):
+    def __init__(self, motor_z, I = 5, *args, rng=None, **kwargs):
         self.stage_z = motor_z
-        self.height = np.random.uniform(-3, 3)
+        self.height = device_rng(rng).uniform(-3, 3)
         self.I = I
         super().__init__(*args, **kwargs)
 
@@ -162,25 +168,24 @@ class SynBeamStopDetector(Signal):
 
 ptDet = SynBeamStopDetector(s_stage.pz, name='ptDet')
 
-# Create simulated image for dexela detector
-def dex_func():
-    """imfunc is a function that produces a simulated dexela image
+class SynMar(ArraySynSignal, SynTiffFilestore):
     """
-    x = np.linspace(1, 6, num=301)
-    intensity = make_random_peaks(x, peak_chance=0.05)*100
-    image = generate_image(x, intensity, (512, 512))
-    return image
-
-def xsp3_func():
-    '''
-    Return a simulated MCA array
-    '''
-    x = np.linspace(1, 2000, num=2000)
-    intensity = make_random_peaks(x)
-    return intensity
+    Simulated MarCCD.
 
-class SynMar(ArraySynSignal, SynTiffFilestore):
-    pass
+    Parameters
+    ----------
+    geometry : ssrlsim.images.DetectorGeometry, optional
+        detector geometry, handed to func as ``geometry=``.  Its cached q
+        and chi maps serve frame generation, masks and integration
+    """
+    def __init__(self, *args, geometry=None, **kwargs):
+        self.geometry = geometry
+        super().__init__(*args, **kwargs)
+
+    def _frame_kwargs(self):
+        kwargs = super()._frame_kwargs()
+        kwargs['geometry'] = self.geometry
+        return kwargs
 
 class SynXsp3(ArraySynSignal, SynHDF5Filestore):
     pass
@@ -188,9 +193,22 @@ class SynXsp3(ArraySynSignal, SynHDF5Filestore):
 
 fpath = Path(os.getcwd()) / 'fstore'
 print(f'Filestore path: {fpath}')
-dexDet = SynMar(name='MarCCD', fstore_path=fpath, func=dex_func)
+# MarCCD binned to 512x512 at 12.7 keV, dex_x spans its q range
+mar_geometry = DetectorGeometry((512, 512), distance=60, pixel_size=0.316,
+                                wavelength=0.9762)
+
+# 16 bit MarCCD frames, 32 bit MCA counts
+dexDet = SynMar(name='MarCCD', fstore_path=fpath, func=dex_func,
+                geometry=mar_geometry, dtype='uint16', scale=100,
+                tiff_mode='run', async_write=True, threaded_trigger=True,
+                noise=DetectorNoise(read_noise=3, dark=10,
+                                    hot_pixel_fraction=1e-4))
 
-xsp3 = SynXsp3(name='Xspress3EXAMPLE', fstore_path=fpath, func=xsp3_func)
+xsp3 = SynXsp3(name='Xspress3EXAMPLE', fstore_path=fpath, func=xsp3_func,
+               dtype='uint32', scale=1000, hdf5_mode='run',
+               async_write=True, threaded_trigger=True)
+
+register_handlers(db, lazy=True)
 
 from ophyd.sim import SynGauss, motor
 import time
@@ -253,6 +271,33 @@ def wiggle_plan(det, motor, start, stop):
     yield from ramp_plan(go_plan, inner_plan, timeout=timeout, take_pre_data=False,
                                 period=1)
 
+
+def fly_line(dets, motor, start, stop, *, duration=None, md=None):
+    """
+    Fly motor from start to stop while dets stream frames.
+
+    Each detector takes a frame every fly_period seconds from kickoff
+    until the move is done, or fly_frames frames if set, and hands them
+    all over in one event page per detector at the end.  The simulated
+    motors move instantly, so give a duration (s) to stretch the ramp.
+    """
+    @bpp.stage_decorator(dets)
+    @bpp.run_decorator(md=md)
+    def inner():
+        yield from bps.mv(motor, start)
+        for det in dets:
+            yield from bps.kickoff(det, wait=True)
+        t0 = time.monotonic()
+        yield from bps.mv(motor, stop)
+        if duration is not None:
+            yield from bps.sleep(max(duration - (time.monotonic() - t0), 0))
+        for det in dets:
+            yield from bps.complete(det, wait=True)
+        for det in dets:
+            yield from bps.collect(det)
+
+    return (yield from inner())
+
 # finalize imports, namespace
 px = s_stage.px
 py = s_stage.py
@@ -2,8 +2,28 @@
 Contains functions used to generate images for various detectors. 
 Much taken from bluesky tutorial materials  
 '''
+import threading
+from functools import lru_cache
+
 import numpy as np
 
+from .streams import device_rng
+
+# Number of radial geometries kept around by generate_image.  Each entry holds
+# a float64 radius map the size of one frame.
+GEOMETRY_CACHE_SIZE = 16
+
+# Number of RadialOperators kept around.  Each holds an index and a weight per
+# pixel, ~16 bytes/pixel.
+OPERATOR_CACHE_SIZE = 16
+
+# Peak parameters as returned by make_random_peaks(return_pristine_peaks=True)
+PEAK_DTYPE = np.dtype([('center', 'f8'), ('sigma', 'f8'), ('amplitude', 'f8')])
+
+# Half-width, in sigma, a peak is rendered over.  exp(-6**2 / 2) ~ 1.5e-8 of
+# the peak height is dropped at the edges.
+PEAK_WINDOW = 6
+
 # General functions
 def gaussian(x, c=0, sig=1, amp=None):
     if amp is None:
@@ -17,10 +37,40 @@ def gaussian(x, c=0, sig=1, amp=None):
 
 
 def make_random_peaks(
-    x, xmin=None, xmax=None, peak_chance=0.1, return_pristine_peaks=False
+    x, xmin=None, xmax=None, peak_chance=0.1, return_pristine_peaks=False,
+    peak_sigma=0.05, window=PEAK_WINDOW, out=None, rng=None
 ):
     """make_random_peaks randomly generates gaussian peaks and produces a 1D 
     diffraction pattern
+
+    Each grid point between xmin and xmax hosts a peak with probability
+    peak_chance.  All peaks are drawn and summed in one vectorised pass.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        1D axis to evaluate the pattern on
+    xmin, xmax : float, optional
+        range peaks may fall in, defaults to the 10th/90th percentile of x
+    peak_chance : float
+        probability of a peak at any grid point
+    return_pristine_peaks : bool
+        if True, also return the drawn peaks as a structured array with
+        PEAK_DTYPE fields (center, sigma, amplitude)
+    peak_sigma : float
+        width of every peak
+    window : float or None
+        render each peak over +/- window * peak_sigma only, see
+        render_peaks.  Ignored, every peak evaluated over all of x, unless
+        x is ascending
+    out : np.ndarray, optional
+        float array of len(x) to write the pattern into
+    rng : np.random.Generator, optional
+        stream to draw peaks from, the global np.random state otherwise
+
+    Returns
+    -------
+        np.ndarray, or (np.ndarray, np.ndarray) if return_pristine_peaks
     """
     # select boundaries for peaks
     if xmin is None:
@@ -28,28 +78,734 @@ def make_random_peaks(
     if xmax is None:
         xmax = np.percentile(x, 90)
 
-    y = np.zeros(len(x))
+    # make peak positions, one draw per grid point
+    draw = (np.random if rng is None else rng).random(len(x))
+    peak_pos = draw < peak_chance
+    peak_pos &= (x >= xmin) & (x <= xmax)
 
-    # make peak positions
-    peak_pos = np.array(np.random.random(len(x)) < peak_chance)
-    peak_pos[x < xmin] = False
-    peak_pos[x > xmax] = False
+    peaks = np.empty(np.count_nonzero(peak_pos), dtype=PEAK_DTYPE)
+    peaks['center'] = x[peak_pos]
+    peaks['sigma'] = peak_sigma
+    peaks['amplitude'] = (1 / peaks['center']) ** 0.5
 
-    for peak_idex in [i for i, x in enumerate(peak_pos) if x]:
-        y += gaussian(x, c=x[peak_idex], sig=0.05, amp=(1 / x[peak_idex]) ** 0.5)
+    if out is not None:
+        out.fill(0)
+    if window is not None and not _ascending(x):
+        window = None
+    y = render_peaks(x, peaks, window=window, out=out)
 
     # now for any diffuse low-Q component
     y += gaussian(x, c=0, sig=3, amp=0.5)
 
+    if return_pristine_peaks:
+        return y, peaks
     return y
 
-def generate_image(x, intensity, shape):
+
+def render_peaks(x, peaks, window=PEAK_WINDOW, out=None):
+    """
+    Sum gaussian peaks described by a PEAK_DTYPE array onto x.
+
+    Each peak is only evaluated on the grid points within
+    +/- window * sigma of its centre and scatter-added into the output, so
+    the cost scales with the number of points under the peaks rather than
+    len(x) * n_peaks.  x must then be sorted ascending.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        1D axis to render onto, ascending unless window is None
+    peaks : np.ndarray
+        PEAK_DTYPE structured array
+    window : float or None
+        half-width of the evaluation window in units of sigma.  None
+        evaluates every peak over all of x
+    out : np.ndarray, optional
+        array to accumulate into, in place.  A new zeroed array otherwise
+
+    Returns
+    -------
+        np.ndarray
+    """
+    if window is not None and not _ascending(x):
+        raise ValueError('x must be ascending to render peaks over a '
+                         'window, use window=None for unsorted axes')
+    if out is None:
+        out = np.zeros(len(x))
+    if len(peaks) == 0:
+        return out
+
+    c = peaks['center']
+    sig = peaks['sigma']
+    if window is None:
+        d = (x - c[:, np.newaxis]) / sig[:, np.newaxis]
+        np.square(d, out=d)
+        d *= -0.5
+        np.exp(d, out=d)
+        out += peaks['amplitude'] @ d
+        return out
+
+    # [lo, hi) index range of every peak's window
+    lo = np.searchsorted(x, c - window * sig, side='left')
+    hi = np.searchsorted(x, c + window * sig, side='right')
+    n = hi - lo
+
+    # flatten all windows into one run of (peak, grid index) pairs
+    which = np.repeat(np.arange(len(peaks)), n)
+    idx = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n) + lo[which]
+
+    vals = (x[idx] - c[which]) / sig[which]
+    np.square(vals, out=vals)
+    vals *= -0.5
+    np.exp(vals, out=vals)
+    vals *= peaks['amplitude'][which]
+    out += np.bincount(idx, weights=vals, minlength=len(x))
+    return out
+
+
+def _ascending(x):
+    return bool(np.all(x[1:] >= x[:-1]))
+
+
+def quantize(frame, dtype, scale=1.0, out=None):
+    """
+    Convert a float frame to a detector dtype.
+
+    The frame is scaled, and for integer dtypes clipped to the dtype's range
+    and rounded, in place before the final cast.
+
+    Parameters
+    ----------
+    frame : np.ndarray
+        float frame, modified in place
+    dtype : np.dtype or str
+        target dtype, eg. 'float32', 'uint16', 'uint32'
+    scale : float
+        counts per unit of frame intensity
+    out : np.ndarray, optional
+        array of ``dtype`` to write the result into
+
+    Returns
+    -------
+        np.ndarray
+    """
+    dtype = np.dtype(dtype)
+    if scale != 1:
+        frame *= scale
+    if dtype.kind in 'ui':
+        info = np.iinfo(dtype)
+        np.clip(frame, info.min, info.max, out=frame)
+        np.rint(frame, out=frame)
+
+    if out is None:
+        return frame.astype(dtype, copy=False)
+    np.copyto(out, frame, casting='unsafe')
+    return out
+
+
+class DetectorNoise:
+    """
+    In-place detector noise model: shot noise, read noise, dark offset and
+    hot pixels.
+
+    Works on float frames in detector counts.  Shot and read noise are
+    drawn together as one gaussian with variance ``gain * counts +
+    read_noise**2`` (the normal approximation to Poisson statistics),
+    through scratch buffers kept per frame shape, so applying noise
+    allocates no full-frame temporaries after the first frame.  Hot pixel
+    positions are picked once per frame shape and stay fixed.
+
+    Parameters
+    ----------
+    shot_noise : bool
+        add photon shot noise
+    gain : float
+        counts per detected photon, scales the shot noise variance
+    read_noise : float
+        rms read noise in counts
+    dark : float
+        constant dark offset in counts
+    hot_pixel_fraction : float
+        fraction of pixels stuck at hot_pixel_value
+    hot_pixel_value : float
+        value hot pixels read
+    rng : np.random.Generator, optional
+        random stream for this detector's hot pixels, and its noise unless
+        apply() is given one.  Defaults to the next device stream from
+        ssrlsim.streams
+    """
+    def __init__(self, shot_noise=True, gain=1.0, read_noise=0.0, dark=0.0,
+                 hot_pixel_fraction=0.0, hot_pixel_value=2**16 - 1,
+                 rng=None):
+        self.shot_noise = shot_noise
+        self.gain = gain
+        self.read_noise = read_noise
+        self.dark = dark
+        self.hot_pixel_fraction = hot_pixel_fraction
+        self.hot_pixel_value = hot_pixel_value
+        self.rng = device_rng(rng)
+        self._buffers = {}
+        self._hot_pixels = {}
+
+    def _scratch(self, frame):
+        key = (frame.shape, frame.dtype)
+        if key not in self._buffers:
+            self._buffers[key] = (np.empty_like(frame), np.empty_like(frame))
+        return self._buffers[key]
+
+    def hot_pixels(self, shape):
+        """Flat indices of the hot pixels for frames of ``shape``"""
+        if shape not in self._hot_pixels:
+            size = int(np.prod(shape))
+            n = int(round(self.hot_pixel_fraction * size))
+            self._hot_pixels[shape] = np.sort(
+                self.rng.choice(size, n, replace=False))
+        return self._hot_pixels[shape]
+
+    def apply(self, frame, rng=None):
+        """
+        Add noise to a float32/float64 frame in place.
+
+        Parameters
+        ----------
+        frame : np.ndarray
+        rng : np.random.Generator, optional
+            stream for this frame's noise, self.rng otherwise
+
+        Returns
+        -------
+            np.ndarray, the same frame
+        """
+        if self.shot_noise or self.read_noise:
+            sigma, z = self._scratch(frame)
+            if self.shot_noise:
+                np.maximum(frame, 0, out=sigma)
+                sigma *= self.gain
+            else:
+                sigma.fill(0)
+            sigma += self.read_noise ** 2
+            np.sqrt(sigma, out=sigma)
+            (self.rng if rng is None else rng).standard_normal(
+                out=z, dtype=frame.dtype)
+            z *= sigma
+            frame += z
+
+        if self.dark:
+            frame += self.dark
+
+        if self.hot_pixel_fraction:
+            frame.flat[self.hot_pixels(frame.shape)] = self.hot_pixel_value
+        return frame
+
+
+class RadialGeometry:
+    """
+    Per-pixel radius map for a frame, in the units of the 1D x axis.
+
+    Built once per (shape, x-range, beam centre) by radial_geometry and
+    shared between every frame rendered with that geometry.  Arrays are
+    read-only since the same instance is handed out to every caller.
+    """
+    def __init__(self, shape, xmax, center):
+        self.shape = shape
+        self.center = center
+        # pixel offsets from the beam centre, as np.mgrid would give them
+        rows, cols = np.ogrid[:shape[0], :shape[1]]
+        ordinal_r = np.hypot(rows - center[0], cols - center[1])
+        self.r = ordinal_r * (xmax / ordinal_r.max())
+        self.r.flags.writeable = False
+
+
+class DetectorGeometry:
+    """
+    Physical geometry of a flat area detector.
+
+    Per-pixel scattering vector (q), azimuth (chi) and two-theta maps are
+    computed on first use and cached on the instance.  Geometries compare
+    equal, and hash, by their parameters, so the interpolation operators
+    built from them are cached as well.
+
+    Parameters
+    ----------
+    shape : tuple
+        (rows, cols) of the detector
+    distance : float
+        sample to detector distance along the beam, mm
+    pixel_size : float
+        pixel pitch, mm
+    center : tuple, optional
+        (row, col) where the direct beam hits the detector, in pixels.
+        Defaults to the middle of the frame
+    tilt : float
+        detector tilt away from normal incidence, degrees
+    tilt_plane : float
+        direction of the tilt axis, degrees counter-clockwise from the
+        column axis
+    wavelength : float
+        X-ray wavelength, Angstrom
+    """
+    def __init__(self, shape, distance, pixel_size, center=None, tilt=0.0,
+                 tilt_plane=0.0, wavelength=1.0):
+        self.shape = (int(shape[0]), int(shape[1]))
+        if center is None:
+            center = ((self.shape[0] - 1) / 2, (self.shape[1] - 1) / 2)
+        self.center = (float(center[0]), float(center[1]))
+        self.distance = float(distance)
+        self.pixel_size = float(pixel_size)
+        self.tilt = float(tilt)
+        self.tilt_plane = float(tilt_plane)
+        self.wavelength = float(wavelength)
+        self._maps = None
+
+    def _key(self):
+        return (self.shape, self.center, self.distance, self.pixel_size,
+                self.tilt, self.tilt_plane, self.wavelength)
+
+    def __eq__(self, other):
+        if not isinstance(other, DetectorGeometry):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __getstate__(self):
+        # the maps are quicker to recompute than to ship between processes
+        state = self.__dict__.copy()
+        state['_maps'] = None
+        return state
+
+    def __repr__(self):
+        return ('{0.__class__.__name__}(shape={0.shape}, '
+                'distance={0.distance}, pixel_size={0.pixel_size}, '
+                'center={0.center}, tilt={0.tilt}, '
+                'tilt_plane={0.tilt_plane}, '
+                'wavelength={0.wavelength})'.format(self))
+
+    def _compute_maps(self):
+        rows, cols = np.ogrid[:self.shape[0], :self.shape[1]]
+        # pixel positions in the detector plane, mm from the beam centre
+        px = (cols - self.center[1]) * self.pixel_size
+        py = (rows - self.center[0]) * self.pixel_size
+
+        # rotate by tilt about an in-plane axis at tilt_plane
+        phi = np.radians(self.tilt_plane)
+        tau = np.radians(self.tilt)
+        u = px * np.cos(phi) + py * np.sin(phi)
+        v = (-px * np.sin(phi) + py * np.cos(phi)) * np.cos(tau)
+        z = (-px * np.sin(phi) + py * np.cos(phi)) * np.sin(tau)
+        lab_x = u * np.cos(phi) - v * np.sin(phi)
+        lab_y = u * np.sin(phi) + v * np.cos(phi)
+        lab_z = z + self.distance
+
+        tth = np.arctan2(np.hypot(lab_x, lab_y), lab_z)
+        q = 4 * np.pi * np.sin(tth / 2) / self.wavelength
+        chi = np.degrees(np.arctan2(lab_y, lab_x))
+        tth = np.degrees(tth)
+        for arr in (q, chi, tth):
+            arr.flags.writeable = False
+        self._maps = (q, chi, tth)
+
+    @property
+    def q(self):
+        """Scattering vector magnitude of every pixel, 1/Angstrom"""
+        if self._maps is None:
+            self._compute_maps()
+        return self._maps[0]
+
+    @property
+    def chi(self):
+        """Azimuth of every pixel, degrees"""
+        if self._maps is None:
+            self._compute_maps()
+        return self._maps[1]
+
+    @property
+    def tth(self):
+        """Scattering angle two-theta of every pixel, degrees"""
+        if self._maps is None:
+            self._compute_maps()
+        return self._maps[2]
+
+    def mask(self, qmin=None, qmax=None, chimin=None, chimax=None):
+        """
+        Boolean mask of pixels inside the given q and chi ranges.
+
+        Limits left as None are not applied.
+        """
+        mask = np.ones(self.shape, dtype=bool)
+        if qmin is not None:
+            mask &= self.q >= qmin
+        if qmax is not None:
+            mask &= self.q <= qmax
+        if chimin is not None:
+            mask &= self.chi >= chimin
+        if chimax is not None:
+            mask &= self.chi <= chimax
+        return mask
+
+    def operator(self, x):
+        """
+        Return the cached RadialOperator mapping profiles on q-axis ``x``
+        onto this detector.
+        """
+        x = np.ascontiguousarray(x, dtype=float)
+        return _cached_detector_operator(self, x.tobytes())
+
+
+class RadialOperator:
+    """
+    Sparse linear operator taking a 1D profile on x to a 2D frame.
+
+    Every pixel is stored as the index of the x bin below it and a linear
+    interpolation weight, so rendering is a gather and a multiply-add, with
+    no bin search per frame.  Values outside x are clamped to the end bins
+    as np.interp does.  The transpose, normalised by the weight landing in
+    each bin, is an azimuthal integration back onto x.
+
+    When coords are mirror symmetric about ``symmetry_center`` (a centred,
+    untilted radial geometry), only the quadrant up to the centre is
+    interpolated and the other three are filled in by mirrored copies.
+
+    Parameters
+    ----------
+    coords : np.ndarray
+        per-pixel coordinate (eg. radius) in units of x
+    x : np.ndarray
+        1D, ascending profile axis
+    symmetry_center : tuple, optional
+        (row, col) coords are symmetric about.  Ignored unless each is a
+        whole or half pixel in the back half of its axis, so every pixel
+        past the centre has a mirror image in the quadrant
+    """
+    def __init__(self, coords, x, symmetry_center=None):
+        self.shape = coords.shape
+        self.nbins = len(x)
+        self.idx, self.w = self._bins(coords, x)
+
+        # A.T @ ones, total weight each bin receives
+        self.norm = (np.bincount(self.idx, weights=1 - self.w,
+                                 minlength=self.nbins)
+                     + np.bincount(self.idx + 1, weights=self.w,
+                                   minlength=self.nbins))
+
+        self.symmetry_center = symmetry_center
+        self.quadrant = _symmetry_quadrant(self.shape, symmetry_center)
+        if self.quadrant is not None:
+            qr, qc = self.quadrant
+            self._q_idx, self._q_w = self._bins(coords[:qr, :qc], x)
+            self._q_w.flags.writeable = False
+
+        # idx stays writeable: np.take copies read-only index arrays
+        for arr in (self.w, self.norm):
+            arr.flags.writeable = False
+        self._local = threading.local()
+
+    @staticmethod
+    def _bins(coords, x):
+        c = coords.ravel()
+        idx = np.searchsorted(x, c, side='right') - 1
+        np.clip(idx, 0, len(x) - 2, out=idx)
+        w = (c - x[idx]) / (x[idx + 1] - x[idx])
+        np.clip(w, 0, 1, out=w)
+        return idx, w
+
+    def _scratch(self, name, shape):
+        # pixel-sized buffers, one set per thread, reused across frames
+        buf = getattr(self._local, name, None)
+        if buf is None:
+            buf = np.empty(shape)
+            setattr(self._local, name, buf)
+        return buf
+
+    @staticmethod
+    def _interp(profiles, idx, w, flat, scratch):
+        # I[idx] for every frame at once, then add the slope term frame by
+        # frame through one scratch row so no (N, pixels) temporary is made
+        np.take(profiles, idx, axis=1, out=flat, mode='clip')
+        slopes = np.diff(profiles, axis=1)
+        for frame, slope in zip(flat, slopes):
+            np.take(slope, idx, out=scratch, mode='clip')
+            scratch *= w
+            frame += scratch
+
+    def render(self, profiles, out=None, symmetric=True):
+        """
+        Apply the operator to one profile or a stack of profiles.
+
+        Parameters
+        ----------
+        profiles : np.ndarray
+            (nbins,) or (N, nbins)
+        out : np.ndarray, optional
+            C-contiguous float array of shape (rows, cols) or
+            (N, rows, cols) to write into
+        symmetric : bool
+            use the mirrored-quadrant fast path when the geometry allows it
+
+        Returns
+        -------
+            np.ndarray
+        """
+        profiles = np.asarray(profiles, dtype=float)
+        lead = profiles.shape[:-1]
+        if out is None:
+            out = np.empty(lead + self.shape)
+        elif out.shape != lead + self.shape:
+            raise ValueError(f'out has shape {out.shape}, '
+                             f'expected {lead + self.shape}')
+        elif not out.flags.c_contiguous:
+            raise ValueError('out must be C-contiguous')
+
+        profiles = profiles.reshape(-1, self.nbins)
+        frames = out.reshape((len(profiles),) + self.shape)
+
+        if not symmetric or self.quadrant is None:
+            scratch = self._scratch('scratch', len(self.idx))
+            self._interp(profiles, self.idx, self.w,
+                         frames.reshape(len(profiles), -1), scratch)
+            return out
+
+        qr, qc = self.quadrant
+        quad = self._scratch('quad', (1, qr * qc))
+        scratch = self._scratch('q_scratch', qr * qc)
+        for profile, frame in zip(profiles, frames):
+            self._interp(profile[np.newaxis], self._q_idx, self._q_w, quad,
+                         scratch)
+            _mirror_fill(frame, quad.reshape(qr, qc), self.symmetry_center)
+        return out
+
+    def integrate(self, image):
+        """
+        Azimuthally integrate a frame back onto x with the transposed
+        operator.
+
+        Returns the weighted mean intensity in each bin; bins no pixel
+        lands in are nan.
+        """
+        image = np.asarray(image, dtype=float).ravel()
+        if len(image) != len(self.idx):
+            raise ValueError(f'image has {len(image)} pixels, '
+                             f'expected {len(self.idx)}')
+        hi = image * self.w
+        total = (np.bincount(self.idx, weights=image - hi,
+                             minlength=self.nbins)
+                 + np.bincount(self.idx + 1, weights=hi,
+                               minlength=self.nbins))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / self.norm
+
+
+def _symmetry_quadrant(shape, center):
+    """
+    (rows, cols) of the top-left block a frame symmetric about center can
+    be mirrored out of, or None if it cannot be.
+    """
+    if center is None:
+        return None
+    quadrant = []
+    for n, c in zip(shape, center):
+        # mirror of pixel i is 2c - i, which has to land in [0, c]
+        if 2 * c != int(2 * c) or not n - 1 <= 2 * c <= 2 * (n - 1):
+            return None
+        quadrant.append(int(c) + 1)
+    return tuple(quadrant)
+
+
+def _mirrored(start, stop, two_c):
+    # indices 2c - i for i in [start, stop), as a (reversed) slice
+    end = two_c - stop
+    return slice(two_c - start, end if end >= 0 else None, -1)
+
+
+def _mirror_fill(frame, quad, center):
+    """Fill frame from its top-left block quad by mirroring about center"""
+    qr, qc = quad.shape
+    rows, cols = frame.shape
+    two_r, two_c = int(2 * center[0]), int(2 * center[1])
+    frame[:qr, :qc] = quad
+    frame[:qr, qc:] = quad[:, _mirrored(qc, cols, two_c)]
+    # whole, contiguous rows for the bottom half
+    frame[qr:] = frame[_mirrored(qr, rows, two_r)]
+
+
+@lru_cache(maxsize=GEOMETRY_CACHE_SIZE)
+def _cached_geometry(shape, xmax, center):
+    return RadialGeometry(shape, xmax, center)
+
+
+@lru_cache(maxsize=OPERATOR_CACHE_SIZE)
+def _cached_operator(shape, center, x_bytes):
+    x = np.frombuffer(x_bytes)
+    geometry = _cached_geometry(shape, float(x.max()), center)
+    return RadialOperator(geometry.r, x, symmetry_center=center)
+
+
+@lru_cache(maxsize=OPERATOR_CACHE_SIZE)
+def _cached_detector_operator(geometry, x_bytes):
+    # q is only mirror symmetric about the beam when untilted
+    center = geometry.center if geometry.tilt == 0 else None
+    return RadialOperator(geometry.q, np.frombuffer(x_bytes),
+                          symmetry_center=center)
+
+
+def _geometry_key(shape, center):
+    shape = (int(shape[0]), int(shape[1]))
+    if center is None:
+        center = (shape[0] // 2, shape[1] // 2)
+    return shape, (float(center[0]), float(center[1]))
+
+
+def radial_geometry(x, shape, center=None):
+    """
+    Return the cached RadialGeometry for a frame of ``shape`` covering ``x``.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        1D axis the radius map is scaled to.  The edge of the frame
+        furthest from the beam centre maps onto ``x.max()``
+    shape : tuple
+        (rows, cols) of the frame
+    center : tuple, optional
+        beam centre in pixels, defaults to the middle of the frame
+
+    Returns
+    -------
+        RadialGeometry
+    """
+    shape, center = _geometry_key(shape, center)
+    return _cached_geometry(shape, float(np.max(x)), center)
+
+
+def radial_operator(x, shape, center=None, geometry=None):
+    """
+    Return the cached RadialOperator mapping profiles on ``x`` to frames
+    of ``shape``.  Same arguments as radial_geometry.
+
+    If a DetectorGeometry is given, x is taken as q (1/Angstrom) and the
+    operator is built from the geometry's q map instead; shape and center
+    then come from the geometry.
+
+    Returns
+    -------
+        RadialOperator
+    """
+    if geometry is not None:
+        if shape is not None and tuple(shape) != geometry.shape:
+            raise ValueError(f'shape {tuple(shape)} does not match '
+                             f'detector geometry {geometry.shape}')
+        return geometry.operator(x)
+    shape, center = _geometry_key(shape, center)
+    x = np.ascontiguousarray(x, dtype=float)
+    return _cached_operator(shape, center, x.tobytes())
+
+
+def clear_geometry_cache():
+    """Drop every cached RadialGeometry and RadialOperator"""
+    _cached_geometry.cache_clear()
+    _cached_operator.cache_clear()
+    _cached_detector_operator.cache_clear()
+
+
+def generate_image(x, intensity, shape, center=None, out=None,
+                   geometry=None):
     """
     Given a 1D array of intensity, generate a 2D diffraction image.
+
+    The interpolation operator for ``x``, ``shape`` and ``center`` is
+    looked up from the geometry cache, so repeated frames only pay for a
+    gather and a multiply-add.  With a DetectorGeometry, x is q and pixels
+    are placed by the geometry's cached q map.
+    """
+    op = radial_operator(x, shape, center=center, geometry=geometry)
+    return op.render(intensity, out=out)
+
+
+def generate_images(x, intensities, shape, center=None, out=None,
+                    geometry=None):
+    """
+    Generate a stack of 2D diffraction images, one per row of intensities.
+
+    All frames share one cached geometry and interpolation operator, so the
+    per-frame cost is a gather and a multiply-add.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        1D axis of the intensity profiles
+    intensities : np.ndarray
+        (N, len(x)) intensity profiles
+    shape : tuple
+        (rows, cols) of each frame
+    center : tuple, optional
+        beam centre in pixels, defaults to the middle of the frame
+    out : np.ndarray, optional
+        preallocated (N, rows, cols) float array to write into
+    geometry : DetectorGeometry, optional
+        place pixels by q instead of by normalised radius
+
+    Returns
+    -------
+        np.ndarray
+    """
+    intensities = np.atleast_2d(intensities)
+    op = radial_operator(x, shape, center=center, geometry=geometry)
+    return op.render(intensities, out=out)
+
+
+def integrate_image(x, image, center=None, geometry=None):
+    """
+    Azimuthally integrate a 2D image onto x.
+
+    Shares the cached RadialOperator with generate_image, so integrating a
+    frame made by generate_image recovers its intensity profile.
+    """
+    op = radial_operator(x, np.shape(image), center=center,
+                         geometry=geometry)
+    return op.integrate(image)
+
+
+# Frame functions for the hitp_waxs detectors.  They live here rather than
+# in hitp_waxs, which sets up a whole beamline on import, so process-pool
+# workers can import them cheaply.
+
+# q axis shared by every frame, so generate_image hits its geometry cache
+dex_x = np.linspace(1, 6, num=301)
+
+
+def dex_func(num_images=None, geometry=None, out=None, rng=None):
+    """imfunc is a function that produces a simulated dexela image
+
+    If num_images is given, return a (num_images, 512, 512) stack instead,
+    rendered in one batched pass.  With a DetectorGeometry, dex_x is taken
+    as q and the frame follows the geometry's beam centre, tilt, etc.
+    The image is rendered into out, if given.  Peaks are drawn from rng,
+    or from one rng per image if given a sequence of them.
     """
-    xL, yL = shape[0] // 2, shape[1] // 2  # half-lengths of each dimension
-    x_, y_ = np.mgrid[-xL:xL, -yL:yL]
-    ordinal_r = np.hypot(x_, y_)
-    unit_r = ordinal_r / ordinal_r.max()
-    r = unit_r * x.max()
-    return np.interp(r, x, intensity)
\ No newline at end of file
+    shape = (512, 512) if geometry is None else geometry.shape
+    if num_images is None:
+        intensity = make_random_peaks(dex_x, peak_chance=0.05, rng=rng)*100
+        image = generate_image(dex_x, intensity, shape, geometry=geometry,
+                               out=out)
+        return image
+
+    if not isinstance(rng, (list, tuple)):
+        rng = [rng] * num_images
+    intensities = np.stack([make_random_peaks(dex_x, peak_chance=0.05,
+                                              rng=r)
+                            for r in rng]) * 100
+    return generate_images(dex_x, intensities, shape, geometry=geometry,
+                           out=out)
+
+
+xsp3_x = np.linspace(1, 2000, num=2000)
+
+
+def xsp3_func(out=None, rng=None):
+    '''
+    Return a simulated MCA array, written into out if given, with peaks
+    drawn from rng
+    '''
+    intensity = make_random_peaks(xsp3_x, out=out, rng=rng)
+    return intensity
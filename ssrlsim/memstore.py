@@ -0,0 +1,90 @@
+'''
+In-memory frame storage, for running the detectors with no filesystem.
+
+Detectors built with backend='memory' put each frame in a MemoryFrameStore
+under its datum_id and emit SSRL_MEMORY resources naming the store.  The
+SSRL_MEMORY handler looks frames up by the same datum_id, so databroker
+reads them back in the same process:
+
+    det = SynMar(name='MarCCD', func=dex_func, backend='memory')
+    register_handlers(db)
+'''
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class MemoryFrameStore:
+    """
+    Size-capped LRU store of frames keyed by datum_id.
+
+    Parameters
+    ----------
+    name : str
+        name resources refer to the store by
+    max_bytes : int
+        total frame bytes held.  Putting a frame past it evicts the least
+        recently used frames; reading an evicted frame raises KeyError
+    """
+    def __init__(self, name, max_bytes=2**30):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._frames)
+
+    def __contains__(self, datum_id):
+        return datum_id in self._frames
+
+    def put(self, datum_id, frame):
+        """Store a copy of frame under datum_id"""
+        frame = np.array(frame, copy=True)
+        frame.flags.writeable = False
+        with self._lock:
+            old = self._frames.pop(datum_id, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._frames[datum_id] = frame
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes and len(self._frames) > 1:
+                _, evicted = self._frames.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def get(self, datum_id):
+        """The frame stored under datum_id, read-only"""
+        with self._lock:
+            frame = self._frames[datum_id]
+            self._frames.move_to_end(datum_id)
+            return frame
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self.nbytes = 0
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name='default', max_bytes=None):
+    """
+    The MemoryFrameStore called name, created on first use.
+
+    Parameters
+    ----------
+    name : str
+    max_bytes : int, optional
+        size cap, applied to the store whether new or existing
+    """
+    with _stores_lock:
+        store = _stores.get(name)
+        if store is None:
+            store = _stores[name] = MemoryFrameStore(name)
+        if max_bytes is not None:
+            store.max_bytes = max_bytes
+        return store
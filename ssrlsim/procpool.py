@@ -0,0 +1,131 @@
+'''
+Process-pool frame generation, for detectors too big to render in threads.
+
+Detectors built with engine='process' call their func in a worker process
+instead of the calling thread.  The func renders into a float buffer in
+shared memory that the detector owns, so only the func, its keyword
+arguments and the buffer's name cross the process boundary, never a whole
+frame.  Randomness comes in with the keyword arguments, as the frame's
+own rng (see ssrlsim.streams).
+
+Workers are started with forkserver, or spawn where there is no
+forkserver, rather than forked from a process already running the
+RunEngine's and the writers' threads.  They import func by reference,
+so it has to live in an importable module, one with no costly side
+effects on import (like ssrlsim.images for dex_func, not hitp_waxs), and
+scripts starting detectors with engine='process' need the usual
+``if __name__ == '__main__':`` guard.
+'''
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # no shared memory on this platform
+    shared_memory = None
+
+from .shmring import _Mapping, _attach, _create, _unlink
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# worker side
+_buffers = {}
+
+
+def _buffer(name, shape):
+    """A worker's view of a SharedFrameBuffer, attached on first use"""
+    shm, buf = _buffers.get(name, (None, None))
+    if buf is None or buf.shape != shape:
+        shm = _attach(name)
+        buf = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        _buffers[name] = shm, buf
+    return buf
+
+
+def _call(func, kwargs, name, shape):
+    out = _buffer(name, shape)
+    if 'out' in kwargs:
+        kwargs['out'] = out
+    frame = func(**kwargs)
+    if frame is not out:
+        np.copyto(out, frame)
+
+
+class SharedFrameBuffer:
+    """
+    A float frame in shared memory that pool workers render into.
+
+    Parameters
+    ----------
+    shape : tuple
+    """
+    def __init__(self, shape):
+        if shared_memory is None:
+            raise RuntimeError('multiprocessing.shared_memory is not '
+                               'available')
+        self.shape = tuple(shape)
+        size = int(np.prod(self.shape)) * np.dtype(float).itemsize
+        self._shm = _create(max(size, 1))
+        self.array = np.asarray(_Mapping(self._shm))[:size].view(
+            float).reshape(self.shape)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def call(self, func, kwargs):
+        """
+        Run func(**kwargs) on the process pool, with any out keyword
+        pointed at this buffer.
+
+        Returns
+        -------
+            np.ndarray, this buffer holding func's frame
+        """
+        get_process_pool().submit(_call, func, kwargs, self.name,
+                                  self.shape).result()
+        return self.array
+
+    def close(self):
+        if self._shm is None:
+            return
+        self.array = None
+        _unlink(self._shm)
+        self._shm = None
+
+
+def get_process_pool(max_workers=None):
+    """
+    The ProcessPoolExecutor process-engine detectors share, started on
+    first use.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        defaults to the number of CPUs
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # not fork: workers would inherit locks held by other threads
+            # mid-acquisition, and whatever files are open (HDF5 locks and
+            # all)
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context(
+                'forkserver' if 'forkserver' in methods else 'spawn')
+            _pool = ProcessPoolExecutor(max_workers=max_workers,
+                                        mp_context=context)
+        return _pool
+
+
+def shutdown_process_pool():
+    """Stop the shared process pool's workers"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
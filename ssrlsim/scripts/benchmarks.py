@@ -0,0 +1,162 @@
+'''
+Timing benchmarks for the simulated detectors.
+
+Run as a script to print every benchmark:
+
+    python -m ssrlsim.scripts.benchmarks
+'''
+import tempfile
+import time
+import timeit
+from pathlib import Path
+
+import numpy as np
+
+from ssrlsim import ArraySynSignal, SynHDF5Filestore, SynTiffFilestore
+from ssrlsim.images import make_random_peaks, radial_operator
+
+# name: SynHDF5Filestore storage settings
+HDF5_PROFILES = {
+    'none': {},
+    'lzf': {'hdf5_compression': 'lzf'},
+    'lzf+shuffle': {'hdf5_compression': 'lzf', 'hdf5_shuffle': True},
+    'gzip-1': {'hdf5_compression': 'gzip', 'hdf5_compression_opts': 1},
+    'gzip-1+shuffle': {'hdf5_compression': 'gzip',
+                       'hdf5_compression_opts': 1, 'hdf5_shuffle': True},
+    'gzip-4+shuffle': {'hdf5_compression': 'gzip',
+                       'hdf5_compression_opts': 4, 'hdf5_shuffle': True},
+}
+
+
+def _best_of(func, number=20, repeat=5):
+    """Best per-call time of func over a few repeats, in seconds"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def bench_quadrant_symmetry(shapes=((512, 512), (2048, 2048))):
+    """
+    Time rendering a radially symmetric frame with and without the
+    mirrored-quadrant fast path.
+    """
+    x = np.linspace(1, 6, num=301)
+    intensity = make_random_peaks(x, peak_chance=0.05) * 100
+    print('quadrant symmetry, generate_image')
+    for shape in shapes:
+        op = radial_operator(x, shape)
+        out = np.empty(shape)
+        full = _best_of(lambda: op.render(intensity, out=out,
+                                          symmetric=False))
+        quad = _best_of(lambda: op.render(intensity, out=out))
+        print(f'  {shape[0]}x{shape[1]}: full {full * 1e3:.2f} ms, '
+              f'quadrant {quad * 1e3:.2f} ms ({full / quad:.1f}x)')
+
+
+class _BenchHDF5(ArraySynSignal, SynHDF5Filestore):
+    pass
+
+
+def _hitp_frames(n):
+    """n dex_func and xsp3_func frames, as the hitp_waxs detectors store
+    them"""
+    # hitp_waxs sets up a RunEngine on import, only pay for that here
+    from ssrlsim import hitp_waxs
+
+    frames = {}
+    for det in (hitp_waxs.dexDet, hitp_waxs.xsp3):
+        stack = []
+        for _ in range(n):
+            stack.append(np.array(det._make_frame()))
+            det._ring.release(det._slot)
+        frames[det._frame_func.__name__] = stack
+    return frames
+
+
+def bench_hdf5_storage(n_frames=50, profiles=HDF5_PROFILES, mode='run'):
+    """
+    Write throughput and bytes on disk of SynHDF5Filestore for dex_func
+    and xsp3_func frames under each storage profile.
+
+    Frames are generated up front, so only the write path is timed.
+    """
+    frames = _hitp_frames(n_frames)
+    print(f'HDF5 storage, {n_frames} frames, hdf5_mode={mode!r}')
+    for name, stack in frames.items():
+        raw = sum(f.nbytes for f in stack)
+        print(f'  {name}: {stack[0].shape} {stack[0].dtype}, '
+              f'{raw / 1e6:.1f} MB raw')
+        for profile, settings in profiles.items():
+            with tempfile.TemporaryDirectory() as tmp:
+                it = iter(stack)
+                det = _BenchHDF5(name='bench', fstore_path=tmp,
+                                 func=lambda: next(it, stack[0]),
+                                 hdf5_mode=mode, ring_size=0, **settings)
+                it = iter(stack)  # construction already drew one frame
+                det.stage()
+                start = time.perf_counter()
+                for _ in stack:
+                    det.trigger()
+                    det._asset_docs_cache.clear()
+                det.unstage()
+                elapsed = time.perf_counter() - start
+                size = sum(p.stat().st_size
+                           for p in Path(tmp).rglob('*.h5'))
+            print(f'    {profile:>15}: {raw / elapsed / 1e6:8.1f} MB/s, '
+                  f'{size / 1e6:7.2f} MB on disk ({raw / size:.1f}x)')
+
+
+class _BenchTiff(ArraySynSignal, SynTiffFilestore):
+    pass
+
+
+class _NoWrite:
+    """Skips the file writes, leaving the per-trigger bookkeeping"""
+    def _write_tiff(self, fpath, val):
+        pass
+
+    def _write_h5(self, fpath, val):
+        pass
+
+
+def bench_trigger_overhead(n_triggers=200, shape=(16, 16), repeat=5):
+    """
+    Per-trigger cost of point-mode SynTiffFilestore and SynHDF5Filestore,
+    unstaged (directory, paths and resource rebuilt every trigger) against
+    staged (all of it set up once in stage()).
+
+    Frames are tiny so the bookkeeping isn't buried under the writes; the
+    'bookkeeping' column skips the writes altogether.
+    """
+    frame = np.ones(shape)
+    print(f'trigger overhead, {n_triggers} triggers of {shape} frames')
+    for name, det_cls in (('tiff', _BenchTiff), ('hdf5', _BenchHDF5)):
+        for write in (True, False):
+            cls = det_cls if write else type('_Bench', (_NoWrite, det_cls),
+                                             {})
+            times = {False: np.inf, True: np.inf}
+            for _ in range(repeat):
+                for staged in (False, True):
+                    with tempfile.TemporaryDirectory() as tmp:
+                        det = cls(name='bench', fstore_path=tmp,
+                                  func=lambda: frame, ring_size=0)
+                        if staged:
+                            det.stage()
+                        start = time.perf_counter()
+                        for _ in range(n_triggers):
+                            det.trigger()
+                            det._asset_docs_cache.clear()
+                        elapsed = time.perf_counter() - start
+                        if staged:
+                            det.unstage()
+                    times[staged] = min(times[staged],
+                                        elapsed / n_triggers)
+            label = 'with writes' if write else 'bookkeeping'
+            print(f'  {name} {label:>11}: unstaged '
+                  f'{times[False] * 1e6:7.1f} us, staged '
+                  f'{times[True] * 1e6:7.1f} us '
+                  f'({times[False] / times[True]:.1f}x)')
+
+
+if __name__ == '__main__':
+    bench_quadrant_symmetry()
+    bench_hdf5_storage()
+    bench_trigger_overhead()
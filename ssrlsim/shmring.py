@@ -0,0 +1,203 @@
+'''
+Shared-memory frame transport, for consumers in other processes.
+
+Detectors built with backend='shm' copy each frame into a SharedFrameRing,
+a ring of frame slots in one named multiprocessing.shared_memory block.
+Their datums give the slot and the frame's sequence number, and the
+SSRL_SHM handler attaches to the block by name and hands out read-only
+views of the slots, without copying:
+
+    handler = SynSharedMemoryHandler(name, shape, dtype, size)
+    frame = handler(slot=3, seq=11)
+    ...
+    handler.release(slot=3, seq=11)
+
+The ring overwrites its oldest slot once it wraps around, unless the
+detector is told to wait for consumers to release it.
+'''
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # no shared memory on this platform
+    resource_tracker = shared_memory = None
+
+_SEQ, _RELEASED = 0, 1
+_EMPTY = -1
+
+# names of the blocks created, and not yet unlinked, by this process
+_created = set()
+
+
+def _create(size, name=None):
+    """Create a block, remembering it was made here"""
+    shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+    _created.add(shm.name)
+    return shm
+
+
+def _unlink(shm):
+    _created.discard(shm.name)
+    shm.unlink()
+
+
+def _attach(name):
+    """
+    Attach to an existing block without adopting it.
+
+    Before python 3.13 every attachment registers the block with this
+    process' resource tracker, which unlinks it, under the feet of the
+    detector that made it, once this process exits.  There the
+    registration is taken back, unless this process shares the creator's
+    tracker, having made the block itself or been started from the process
+    that did by multiprocessing (eg. the process pool's workers): the
+    registration is then the creator's own.  A consumer started by
+    multiprocessing from some other process keeps its registration.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    if (os.name == 'posix' and shm.name not in _created and
+            multiprocessing.parent_process() is None):
+        resource_tracker.unregister('/' + shm.name, 'shared_memory')
+    return shm
+
+
+class _Mapping:
+    """
+    The bytes of a shared memory block, mapped for as long as any array
+    on them is alive.  Arrays numpy makes on a SharedMemory's buffer don't
+    keep it mapped, so SharedMemory.close() would pull the memory out from
+    under them.  Arrays made on this (np.asarray) hold on to it instead,
+    and the block is closed once the last of them is gone.
+    """
+    def __init__(self, shm):
+        self._shm = shm
+        self._bytes = np.frombuffer(shm.buf, dtype=np.uint8)
+        self.__array_interface__ = self._bytes.__array_interface__
+
+    def __del__(self):
+        # the bytes hold the buffer open, so they go first
+        self._bytes = None
+        self._shm.close()
+
+
+class SharedFrameRing:
+    """
+    Ring of frame slots in a named shared memory block.
+
+    A header row per slot holds the sequence number of the frame in it
+    (-1 while empty or being written) and whether consumers have released
+    it.
+
+    Parameters
+    ----------
+    shape : tuple
+        frame shape
+    dtype : np.dtype or str
+    size : int
+        number of slots
+    name : str, optional
+        block name, made up if creating
+    create : bool
+        create the block, else attach to an existing one
+    """
+    def __init__(self, shape, dtype, size=8, name=None, create=True):
+        if shared_memory is None:
+            raise RuntimeError('multiprocessing.shared_memory is not '
+                               'available')
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.size = size
+        header_bytes = size * 2 * 8
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        if create:
+            self._shm = _create(header_bytes + max(frame_bytes * size, 1),
+                                name=name)
+        else:
+            self._shm = _attach(name)
+        self._owner = create
+        # as long as any view is alive, the block stays mapped
+        block = np.asarray(_Mapping(self._shm))
+        self._header = block[:header_bytes].view(np.int64).reshape(size, 2)
+        self.frames = block[header_bytes:][:frame_bytes * size].view(
+            self.dtype).reshape((size,) + self.shape)
+        if create:
+            self._header[:, _SEQ] = _EMPTY
+            self._header[:, _RELEASED] = 1
+        self._next_seq = 0
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def claim(self):
+        """
+        Next sequence number, producer side.
+
+        Returns
+        -------
+            (slot, seq)
+        """
+        seq = self._next_seq
+        self._next_seq += 1
+        return seq % self.size, seq
+
+    def put(self, slot, seq, frame, timeout=None):
+        """
+        Copy frame into slot as frame seq.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            wait this long for consumers to release the frame in the slot,
+            then raise RuntimeError.  None overwrites it regardless
+        """
+        header = self._header[slot]
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+            while (header[_SEQ] != _EMPTY and not header[_RELEASED]):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(
+                        f'shared memory slot {slot} was not released '
+                        f'within {timeout} s')
+                time.sleep(1e-4)
+        # readers see the slot as empty while it is rewritten
+        header[_SEQ] = _EMPTY
+        header[_RELEASED] = 0
+        self.frames[slot] = frame
+        header[_SEQ] = seq
+
+    def get(self, slot, seq):
+        """
+        Read-only view of frame seq.  Raises KeyError if the slot has
+        moved on to a later frame.
+        """
+        if self._header[slot, _SEQ] != seq:
+            raise KeyError(f'frame {seq} is no longer in slot {slot} of '
+                           f'{self.name}')
+        view = self.frames[slot].view()
+        view.flags.writeable = False
+        return view
+
+    def release(self, slot, seq):
+        """Hand frame seq back to the producer"""
+        if self._header[slot, _SEQ] == seq:
+            self._header[slot, _RELEASED] = 1
+
+    def close(self):
+        """
+        Detach, and remove the block if this ring created it.  The mapping
+        stays alive as long as views handed out by get() do.
+        """
+        if self._shm is None:
+            return
+        self.frames = self._header = None
+        if self._owner:
+            _unlink(self._shm)
+        self._shm = None
@@ -0,0 +1,61 @@
+'''
+Reproducible random streams for the simulated devices.
+
+Every device draws from its own numpy.random.Generator, split off one root
+SeedSequence with SeedSequence.spawn in the order devices are created.
+Detectors split their stream again per frame, so a frame comes out the
+same whichever thread or process renders it, and in whatever batch.
+
+Seed the root before building devices to reproduce a session, either with
+set_seed() or the SSRLSIM_SEED environment variable:
+
+    from ssrlsim import streams
+    streams.set_seed(1234)
+'''
+import os
+import threading
+
+import numpy as np
+
+_root = None
+_lock = threading.Lock()
+
+
+def set_seed(seed=None):
+    """
+    Restart the root stream devices are split from.
+
+    Parameters
+    ----------
+    seed : int, optional
+        fresh entropy if None
+    """
+    global _root
+    with _lock:
+        _root = np.random.SeedSequence(seed)
+
+
+def device_seed():
+    """The next device's SeedSequence, spawned from the root"""
+    with _lock:
+        return _root.spawn(1)[0]
+
+
+def device_rng(seed=None):
+    """
+    A device's np.random.Generator.
+
+    Parameters
+    ----------
+    seed : int, SeedSequence or Generator, optional
+        seed for this device alone, the next spawn of the root otherwise
+    """
+    if isinstance(seed, np.random.Generator):
+        return seed
+    if seed is None:
+        seed = device_seed()
+    return np.random.default_rng(seed)
+
+
+_seed = os.environ.get('SSRLSIM_SEED')
+set_seed(None if _seed is None else int(_seed))
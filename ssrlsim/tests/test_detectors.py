@@ -0,0 +1,120 @@
+import sys
+import time
+
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky.plans import count
+
+from ssrlsim import ArraySynSignal
+from ssrlsim.images import DetectorNoise, dex_func
+from ssrlsim.procpool import get_process_pool, shutdown_process_pool
+
+
+def test_func_array_left_alone():
+    "Scaling and noise work on a copy of an array func hands out."
+    arr = np.ones((4, 4))
+    det = ArraySynSignal(name='det', func=lambda: arr, backend='memory',
+                         memory_store='test_detectors', scale=2,
+                         noise=DetectorNoise(read_noise=1))
+    for _ in range(3):
+        det.trigger().wait(10)
+    assert np.all(arr == 1)
+    assert not np.array_equal(det.get(), 2 * arr)
+
+
+def test_ring_without_filestore():
+    "A detector with nothing storing its frames keeps cycling its ring."
+    det = ArraySynSignal(name='det', func=lambda: np.ones((4, 4)),
+                         ring_size=2)
+    for _ in range(5):
+        det.trigger().wait(1)
+    np.testing.assert_array_equal(det.get(), np.ones((4, 4)))
+
+
+def test_ring_survives_func_errors():
+    "A frame func fails on doesn't hold on to its slot."
+    fail = []
+
+    def func():
+        if fail:
+            raise RuntimeError('no beam')
+        return np.ones((4, 4))
+
+    det = ArraySynSignal(name='det', func=func, backend='memory',
+                         memory_store='test_detectors', ring_size=2)
+    fail.append(True)
+    for _ in range(3):
+        with pytest.raises(RuntimeError, match='no beam'):
+            det.trigger()
+    fail.clear()
+    for _ in range(3):
+        det.trigger().wait(1)
+
+
+def test_asset_docs_cap():
+    "Past the high water mark trigger() raises, until the documents go."
+    det = ArraySynSignal(name='det', func=lambda: np.ones((4, 4)),
+                         backend='memory', memory_store='test_detectors',
+                         asset_docs_high_water=4)
+    other = ArraySynSignal(name='other', func=lambda: np.ones((4, 4)),
+                           backend='memory', memory_store='test_detectors')
+    for _ in range(3):
+        det.trigger().wait(1)
+    start = time.monotonic()
+    with pytest.raises(RuntimeError, match='collect_asset_docs'):
+        det.trigger()
+    assert time.monotonic() - start < 1
+    # the queue is the detector's own
+    other.trigger().wait(1)
+    assert len(list(det.collect_asset_docs())) == 4
+    det.trigger().wait(1)
+
+
+def test_threaded_triggers_overlap():
+    "Detectors triggered together in a plan take their frames together."
+    def slow():
+        time.sleep(0.5)
+        return np.ones((4, 4))
+
+    dets = [ArraySynSignal(name=name, func=slow, backend='memory',
+                           memory_store='test_detectors',
+                           threaded_trigger=True)
+            for name in ('det1', 'det2')]
+    status = dets[0].trigger()
+    assert not status.done
+    status.wait(10)
+
+    RE = RunEngine({})
+    start = time.monotonic()
+    RE(count(dets, num=2))
+    # two points of two frames each, half a second per frame
+    assert time.monotonic() - start < 1.6
+
+
+def frames(n=3, **kwargs):
+    "n frames of a seeded detector rendering dex_func"
+    det = ArraySynSignal(name='det', func=dex_func, backend='memory',
+                         memory_store='test_detectors', seed=42,
+                         dtype='uint16', scale=100, **kwargs)
+    out = []
+    for _ in range(n):
+        det.trigger().wait(60)
+        out.append(np.array(det.get()))
+    det.destroy()
+    return out
+
+
+def _loaded(module):
+    return module in sys.modules
+
+
+def test_process_engine():
+    "Pool workers render the frames threads would, without hitp_waxs."
+    try:
+        for got, expected in zip(frames(engine='process'), frames()):
+            np.testing.assert_array_equal(got, expected)
+        loaded = get_process_pool().submit(_loaded, 'ssrlsim.hitp_waxs')
+        assert not loaded.result(60)
+    finally:
+        shutdown_process_pool()
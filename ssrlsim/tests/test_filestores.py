@@ -0,0 +1,217 @@
+import os
+
+import h5py
+import numpy as np
+import pytest
+from area_detector_handlers.handlers import AreaDetectorTiffHandler
+from databroker import Broker
+
+from ssrlsim import (ArraySynSignal, SynHDF5Filestore, SynNPYFilestore,
+                     SynTiffFilestore)
+from ssrlsim.handlers import HANDLERS, register_handlers
+
+
+class HDF5Det(ArraySynSignal, SynHDF5Filestore):
+    pass
+
+
+class TiffDet(ArraySynSignal, SynTiffFilestore):
+    pass
+
+
+class NPYDet(ArraySynSignal, SynNPYFilestore):
+    pass
+
+
+def frame(rng):
+    return rng.random((6, 5))
+
+
+def acquire(det, n):
+    "Stage, take n frames and unstage det, returning frames and documents."
+    det.stage()
+    frames = []
+    for _ in range(n):
+        det.trigger().wait(10)
+        frames.append(np.array(det.get()))
+    det.unstage()
+    return frames, list(det.collect_asset_docs())
+
+
+def read_back(docs):
+    "Load every datum through the handler registered for its spec."
+    handlers = {spec: h for h in HANDLERS for spec in h.specs}
+    handlers['AD_TIFF'] = AreaDetectorTiffHandler
+    resources = {}
+    opened = {}
+    frames = []
+    for name, doc in docs:
+        if name == 'resource':
+            resources[doc['uid']] = doc
+            continue
+        res = resources[doc['resource']]
+        if res['uid'] not in opened:
+            fpath = os.path.join(res['root'], res['resource_path'])
+            opened[res['uid']] = handlers[res['spec']](
+                fpath, **res['resource_kwargs'])
+        frames.append(np.array(opened[res['uid']](**doc['datum_kwargs'])))
+    for handler in opened.values():
+        handler.close()
+    return frames
+
+
+def check(det, n=3):
+    frames, docs = acquire(det, n)
+    assert [name for name, _ in docs].count('datum') == n
+    for got, expected in zip(read_back(docs), frames):
+        np.testing.assert_array_equal(got, expected)
+    det.destroy()
+    return docs
+
+
+@pytest.mark.parametrize('async_write', [False, True])
+def test_hdf5_run(tmp_path, async_write):
+    "A run's frames go in one HDF5 file, read back through SSRL_HDF5."
+    docs = check(HDF5Det(name='det', fstore_path=tmp_path, func=frame,
+                         dtype='uint16', scale=1000, hdf5_mode='run',
+                         async_write=async_write))
+    assert [name for name, _ in docs].count('resource') == 1
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'lzf'])
+def test_hdf5_compression(tmp_path, compression):
+    "Compressed, chunked frames come back unchanged."
+    docs = check(HDF5Det(name='det', fstore_path=tmp_path, func=frame,
+                         dtype='uint16', scale=1000, hdf5_mode='run',
+                         hdf5_chunks=(2, 3, 5), hdf5_shuffle=True,
+                         hdf5_compression=compression))
+    res = docs[0][1]
+    with h5py.File(os.path.join(res['root'], res['resource_path'])) as f:
+        dset = f[res['resource_kwargs']['key']]
+        assert dset.compression == compression
+        assert dset.shuffle
+        assert dset.chunks == (2, 3, 5)
+
+
+@pytest.mark.parametrize('async_write', [False, True])
+def test_tiff_run(tmp_path, async_write):
+    "A run's frames are pages of one TIFF, read back by SSRL_TIFF_STACK."
+    docs = check(TiffDet(name='det', fstore_path=tmp_path, func=frame,
+                         dtype='uint16', scale=1000, tiff_mode='run',
+                         async_write=async_write))
+    assert [name for name, _ in docs].count('resource') == 1
+
+
+@pytest.mark.parametrize('npy_format', ['npy', 'raw'])
+def test_npy(tmp_path, npy_format):
+    "NPY and raw frames map back through SSRL_NPY, across files."
+    docs = check(NPYDet(name='det', fstore_path=tmp_path, func=frame,
+                        dtype='float32', npy_format=npy_format,
+                        npy_capacity=2), n=5)
+    assert [name for name, _ in docs].count('resource') == 3
+
+
+@pytest.mark.parametrize('cls, kwargs', [
+    (HDF5Det, {'hdf5_mode': 'point'}),
+    (TiffDet, {'tiff_mode': 'point'}),
+])
+@pytest.mark.parametrize('async_write', [False, True])
+def test_point_series(tmp_path, cls, kwargs, async_write):
+    "Staged point mode writes a file per frame under one resource."
+    docs = check(cls(name='det', fstore_path=tmp_path, func=frame,
+                     dtype='uint16', scale=1000, async_write=async_write,
+                     **kwargs))
+    assert [name for name, _ in docs].count('resource') == 1
+    assert len(os.listdir(tmp_path / 'tmp')) == 3
+
+
+def test_unstaged(tmp_path):
+    "Unstaged triggers fall back to a resource per frame."
+    for cls in (HDF5Det, TiffDet):
+        det = cls(name='det', fstore_path=tmp_path, func=frame)
+        det.trigger().wait(10)
+        expected = np.array(det.get())
+        got, = read_back(list(det.collect_asset_docs()))
+        if cls is TiffDet:
+            # areaDetector's handler, a stack of one
+            got, = got
+        np.testing.assert_array_equal(got, expected)
+
+
+def test_handlers_keep_to_own_specs():
+    "Registering the handlers leaves the areaDetector ones alone."
+    db = Broker.named('temp')
+    standard = {spec: db.reg.handler_reg[spec]
+                for spec in ('AD_TIFF', 'XSP3')}
+    register_handlers(db)
+    for spec, handler in standard.items():
+        assert db.reg.handler_reg[spec] is handler
+    for handler in HANDLERS:
+        for spec in handler.specs:
+            assert spec.startswith('SSRL_')
+            assert db.reg.handler_reg[spec] is handler
+
+
+def test_memory():
+    "Frames put in a memory store come back through SSRL_MEMORY."
+    check(ArraySynSignal(name='det', func=frame, backend='memory',
+                         memory_store='test_memory'))
+
+
+def test_shm():
+    "Frames in the shared memory ring come back through SSRL_SHM."
+    det = ArraySynSignal(name='det', func=frame, backend='shm', shm_size=4)
+    frames, docs = acquire(det, 3)
+    for got, expected in zip(read_back(docs), frames):
+        np.testing.assert_array_equal(got, expected)
+    det.destroy()
+
+
+@pytest.mark.parametrize('async_write', [False, True])
+def test_write_error_fails_trigger(tmp_path, async_write):
+    "A failed write fails its trigger with the write's own error."
+    det = HDF5Det(name='det', fstore_path=tmp_path, func=frame,
+                  hdf5_mode='run', hdf5_compression='bogus',
+                  async_write=async_write)
+    det.stage()
+    with pytest.raises(ValueError, match='bogus'):
+        det.trigger().wait(10)
+    if async_write:
+        # and unstage(), waiting on the writes, raises it again
+        with pytest.raises(ValueError, match='bogus'):
+            det.unstage()
+    else:
+        det.unstage()
+    det.destroy()
+
+
+@pytest.mark.parametrize('cls, kwargs, key', [
+    (HDF5Det, {'hdf5_mode': 'run'}, 'frame'),
+    (TiffDet, {'tiff_mode': 'run'}, 'page'),
+])
+def test_num_images_ranges(tmp_path, cls, kwargs, key):
+    "A num_images stack is one datum over a range of frames."
+    det = cls(name='det', fstore_path=tmp_path, func=frame, num_images=4,
+              dtype='uint16', scale=1000, **kwargs)
+    frames, docs = acquire(det, 2)
+    datums = [doc['datum_kwargs'] for name, doc in docs if name == 'datum']
+    assert datums == [{key: 0, 'count': 4}, {key: 4, 'count': 4}]
+    for got, expected in zip(read_back(docs), frames):
+        assert got.shape == (4, 6, 5)
+        np.testing.assert_array_equal(got, expected)
+    det.destroy()
+
+
+@pytest.mark.parametrize('cls, kwargs', [
+    (HDF5Det, {'hdf5_mode': 'point'}),
+    (TiffDet, {'tiff_mode': 'point'}),
+])
+def test_num_images_points(tmp_path, cls, kwargs):
+    "In point mode a num_images stack is one file per point."
+    det = cls(name='det', fstore_path=tmp_path, func=frame, num_images=3,
+              dtype='uint16', scale=1000, **kwargs)
+    frames, docs = acquire(det, 2)
+    for got, expected in zip(read_back(docs), frames):
+        assert got.shape == (3, 6, 5)
+        np.testing.assert_array_equal(got, expected)
+    det.destroy()
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from bluesky import RunEngine
+from bluesky.utils import FailedStatus
+from databroker import Broker
+from ophyd.sim import SynAxis
+
+from ssrlsim import ArraySynSignal
+from ssrlsim.handlers import register_handlers
+
+
+def frame(rng):
+    return rng.random((6, 5))
+
+
+@pytest.fixture
+def beamline():
+    "A RunEngine saving to a temp Broker, and the hitp_waxs flyers"
+    # hitp_waxs sets up its own beamline on import, only pay for it here
+    from ssrlsim import hitp_waxs
+
+    RE = RunEngine({})
+    db = Broker.named('temp')
+    RE.subscribe(db.insert)
+    register_handlers(db)
+    return RE, db, hitp_waxs
+
+
+def test_fly_line(tmp_path, beamline):
+    "Flown frames land in databroker and fill back in through the handlers."
+    RE, db, hitp_waxs = beamline
+    det = hitp_waxs.SynMar(name='MarCCD', fstore_path=tmp_path, func=frame,
+                           dtype='uint16', scale=1000, tiff_mode='run',
+                           async_write=True, fly_period=0.01, fly_frames=5)
+    frames = []
+    det.subscribe(lambda value, **kwargs: frames.append(np.array(value)),
+                  run=False)
+    RE(hitp_waxs.fly_line([det], SynAxis(name='motor'), 0, 1))
+    table = db[-1].table('MarCCD', fill=True)
+    assert len(table) == 5
+    for got, expected in zip(table['MarCCD'], frames):
+        np.testing.assert_array_equal(got, expected)
+
+
+def test_fly_line_write_failure(tmp_path, beamline):
+    "A frame that fails to store fails complete(), whichever it is."
+    RE, db, hitp_waxs = beamline
+    det = hitp_waxs.SynMar(name='MarCCD', fstore_path=tmp_path, func=frame,
+                           tiff_mode='run', async_write=True,
+                           fly_period=0.01, fly_frames=5)
+    append_pages = det._append_pages
+    calls = []
+
+    def flaky(*args):
+        calls.append(args)
+        if len(calls) == 2:
+            raise OSError('disk full')
+        append_pages(*args)
+
+    det._append_pages = flaky
+    with pytest.raises(FailedStatus):
+        RE(hitp_waxs.fly_line([det], SynAxis(name='motor'), 0, 1))
+    assert isinstance(det.complete().exception(), OSError)
+
+
+def test_collect_before_kickoff():
+    "A flyer that hasn't flown has nothing to collect."
+    det = ArraySynSignal(name='det', func=frame, backend='memory')
+    assert list(det.collect()) == []
@@ -0,0 +1,152 @@
+import numpy as np
+import pytest
+
+from ssrlsim.images import (PEAK_WINDOW, DetectorGeometry, DetectorNoise,
+                            generate_image, generate_images,
+                            make_random_peaks, quantize, radial_operator,
+                            render_peaks)
+
+x = np.linspace(1, 6, num=301)
+
+
+def interp_image(x, intensity, shape):
+    "The original generate_image: np.interp over a centred radius map."
+    xL, yL = shape[0] // 2, shape[1] // 2
+    x_, y_ = np.mgrid[-xL:xL, -yL:yL]
+    ordinal_r = np.hypot(x_, y_)
+    r = ordinal_r / ordinal_r.max() * x.max()
+    return np.interp(r, x, intensity)
+
+
+def test_peak_window_matches_full_peaks():
+    "Truncating peaks to +/- PEAK_WINDOW sigma changes next to nothing."
+    windowed, peaks = make_random_peaks(x, window=PEAK_WINDOW,
+                                        return_pristine_peaks=True,
+                                        rng=np.random.default_rng(3))
+    full = make_random_peaks(x, window=None, rng=np.random.default_rng(3))
+    assert len(peaks)
+    np.testing.assert_allclose(windowed, full, rtol=0, atol=1e-7)
+
+
+def test_peak_window_unsorted_axis():
+    "An axis that isn't ascending gets every peak, not a window of none."
+    rev = x[::-1]
+    windowed, peaks = make_random_peaks(rev, return_pristine_peaks=True,
+                                        rng=np.random.default_rng(4))
+    full = make_random_peaks(rev, window=None, rng=np.random.default_rng(4))
+    assert len(peaks)
+    np.testing.assert_array_equal(windowed, full)
+    with pytest.raises(ValueError):
+        render_peaks(rev, peaks)
+
+
+def test_generate_images_matches_frames():
+    "A batched stack matches frames rendered one at a time."
+    rng = np.random.default_rng(2)
+    intensities = np.stack([make_random_peaks(x, rng=rng) for _ in range(3)])
+    stack = generate_images(x, intensities, (32, 32))
+    for frame, intensity in zip(stack, intensities):
+        np.testing.assert_allclose(frame,
+                                   generate_image(x, intensity, (32, 32)),
+                                   rtol=0, atol=1e-12)
+
+
+def test_render_matches_interp():
+    "The sparse operator renders what np.interp does."
+    intensity = make_random_peaks(x, rng=np.random.default_rng(0))
+    for shape in [(64, 64), (64, 48), (30, 50)]:
+        np.testing.assert_allclose(generate_image(x, intensity, shape),
+                                   interp_image(x, intensity, shape),
+                                   rtol=0, atol=1e-12)
+
+
+def test_symmetric_render_matches_full():
+    "Mirroring one quadrant gives the same frame as interpolating it all."
+    intensity = make_random_peaks(x, rng=np.random.default_rng(1))
+    # the default, whole pixel centre and a half pixel one
+    for shape, center in [((64, 48), None), ((63, 48), (31, 23.5))]:
+        op = radial_operator(x, shape, center=center)
+        assert op.quadrant is not None
+        np.testing.assert_allclose(op.render(intensity),
+                                   op.render(intensity, symmetric=False),
+                                   rtol=0, atol=1e-12)
+
+
+def test_quantize_clips_and_rounds():
+    "Integer dtypes clip to their range and round, floats only cast."
+    frame = np.array([-5, 0.4, 0.6, 2.5, 3.5, 7e4])
+    np.testing.assert_array_equal(quantize(frame.copy(), 'uint16'),
+                                  [0, 0, 1, 2, 4, 2**16 - 1])
+    np.testing.assert_array_equal(quantize(frame.copy(), 'int16', scale=10),
+                                  [-50, 4, 6, 25, 35, 2**15 - 1])
+    out = np.empty(len(frame), dtype='uint32')
+    assert quantize(frame.copy(), 'uint32', out=out) is out
+    np.testing.assert_array_equal(out, [0, 0, 1, 2, 4, 70000])
+    got = quantize(frame.copy(), 'float32')
+    assert got.dtype == np.float32
+    np.testing.assert_array_equal(got, frame.astype('float32'))
+
+
+def test_noise_statistics():
+    "Shot and read noise add in quadrature, on top of the dark offset."
+    noise = DetectorNoise(gain=2, read_noise=3, dark=10,
+                          rng=np.random.default_rng(5))
+    frame = noise.apply(np.full((400, 400), 100.0))
+    assert abs(frame.mean() - 110) < 0.2
+    assert abs(frame.std() - np.sqrt(2 * 100 + 3**2)) < 0.2
+    # same stream, same noise
+    again = noise.apply(np.full((400, 400), 100.0),
+                        rng=np.random.default_rng(6))
+    np.testing.assert_array_equal(
+        again, noise.apply(np.full((400, 400), 100.0),
+                           rng=np.random.default_rng(6)))
+
+
+def test_hot_pixels():
+    "Hot pixels cover their fraction of the frame and stay put."
+    noise = DetectorNoise(shot_noise=False, hot_pixel_fraction=1e-3,
+                          hot_pixel_value=4000, rng=np.random.default_rng(7))
+    first = noise.apply(np.zeros((200, 300)))
+    hot = np.flatnonzero(first == 4000)
+    assert len(hot) == 60
+    np.testing.assert_array_equal(hot, noise.hot_pixels((200, 300)))
+    second = noise.apply(np.ones((200, 300)))
+    np.testing.assert_array_equal(np.flatnonzero(second == 4000), hot)
+    assert np.all(np.delete(second, hot) == 1)
+
+
+def test_geometry_q_chi():
+    "q and chi follow from the distance, pixel size and wavelength."
+    geo = DetectorGeometry((101, 81), distance=100, pixel_size=0.5,
+                           wavelength=1.5)
+    assert geo.q[50, 40] == 0
+    # 20 pixels along the columns, then along the rows
+    tth = np.arctan(20 * 0.5 / 100)
+    q = 4 * np.pi * np.sin(tth / 2) / 1.5
+    np.testing.assert_allclose([geo.q[50, 60], geo.q[70, 40],
+                                geo.q[50, 20], geo.q[30, 40]], q)
+    np.testing.assert_allclose([geo.chi[50, 60], geo.chi[70, 40],
+                                abs(geo.chi[50, 20]), geo.chi[30, 40]],
+                               [0, 90, 180, -90])
+    np.testing.assert_allclose(geo.tth[50, 60], np.degrees(tth))
+    assert geo.operator(x).quadrant is not None
+
+
+def test_geometry_tilt():
+    "A tilt about the column axis moves pixels along the rows off plane."
+    tau = np.radians(10)
+    geo = DetectorGeometry((101, 81), distance=100, pixel_size=0.5,
+                           tilt=10, wavelength=1.5)
+    # the tilt axis itself doesn't move
+    flat = DetectorGeometry((101, 81), distance=100, pixel_size=0.5,
+                            wavelength=1.5)
+    np.testing.assert_allclose(geo.q[50], flat.q[50])
+    for row in (70, 30):
+        off = (row - 50) * 0.5
+        tth = np.arctan2(abs(off) * np.cos(tau), 100 + off * np.sin(tau))
+        np.testing.assert_allclose(geo.tth[row, 40], np.degrees(tth))
+    assert geo.q[70, 40] < flat.q[70, 40] < geo.q[30, 40]
+    assert geo.operator(x).quadrant is None
+    assert geo != flat
+    assert geo == DetectorGeometry((101, 81), distance=100, pixel_size=0.5,
+                                   tilt=10, wavelength=1.5)
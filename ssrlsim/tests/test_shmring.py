@@ -0,0 +1,57 @@
+import gc
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+import ssrlsim
+from ssrlsim.handlers import SynSharedMemoryHandler
+from ssrlsim.shmring import SharedFrameRing
+
+CONSUMER = '''
+import sys
+from ssrlsim.handlers import SynSharedMemoryHandler
+handler = SynSharedMemoryHandler(sys.argv[1], (3, 4), 'uint16', 2)
+print(int(handler(slot=1, seq=1).sum()))
+handler.release(slot=1, seq=1)
+handler.close()
+'''
+
+
+def test_attach_from_another_process():
+    "A consumer process reads frames and leaves the block to its creator."
+    ring = SharedFrameRing((3, 4), 'uint16', size=2)
+    for seq in range(2):
+        slot, seq = ring.claim()
+        ring.put(slot, seq, np.full((3, 4), seq + 1))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.dirname(os.path.dirname(ssrlsim.__file__))] +
+        sys.path))
+    for _ in range(2):
+        done = subprocess.run([sys.executable, '-c', CONSUMER, ring.name],
+                              capture_output=True, text=True, env=env,
+                              timeout=60)
+        assert done.returncode == 0, done.stderr
+        assert done.stdout.split() == ['24']
+        # the consumer's exit doesn't take the block with it
+        assert 'leaked' not in done.stderr
+    handler = SynSharedMemoryHandler(ring.name, (3, 4), 'uint16', 2)
+    np.testing.assert_array_equal(handler(slot=1, seq=1), 2)
+    assert ring._header[1, 1] == 1  # released by the consumer
+    handler.close()
+    ring.close()
+
+
+def test_views_outlive_the_ring():
+    "Frames handed out stay readable once the rings are closed."
+    ring = SharedFrameRing((3, 4), 'float64', size=2)
+    slot, seq = ring.claim()
+    ring.put(slot, seq, np.arange(12).reshape(3, 4))
+    handler = SynSharedMemoryHandler(ring.name, (3, 4), 'float64', 2)
+    frame = handler(slot=slot, seq=seq)
+    handler.close()
+    ring.close()
+    del handler, ring
+    gc.collect()
+    np.testing.assert_array_equal(frame, np.arange(12).reshape(3, 4))
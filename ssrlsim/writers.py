@@ -0,0 +1,114 @@
+'''
+Background writing, and triggering, for the filestore detectors.
+
+A single writer thread drains a bounded queue of write jobs, so the
+RunEngine does not block on disk I/O at every point.  Each job completes
+an ophyd status, which fails with the job's exception if the write does.
+
+Detectors with threaded_trigger build their frames on a shared thread
+pool, so the detectors of one trigger group overlap.
+'''
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from ophyd.status import Status
+
+
+class BackgroundWriter:
+    """
+    One daemon thread running write jobs in submission order.
+
+    Parameters
+    ----------
+    maxsize : int
+        jobs allowed in the queue.  submit() blocks once it is full, which
+        holds acquisition back to the speed of the disk
+    """
+    def __init__(self, maxsize=16):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='ssrlsim-writer',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            job, status = self._queue.get()
+            try:
+                job()
+            except Exception as exc:
+                status.set_exception(exc)
+            else:
+                status.set_finished()
+            finally:
+                self._queue.task_done()
+
+    def submit(self, job, status=None):
+        """
+        Queue job() to run on the writer thread.
+
+        Parameters
+        ----------
+        job : callable
+            takes no arguments
+        status : ophyd.status.StatusBase, optional
+            status to complete, a new Status otherwise
+
+        Returns
+        -------
+            ophyd.status.StatusBase
+        """
+        if status is None:
+            status = Status()
+        self._ensure_thread()
+        self._queue.put((job, status))
+        return status
+
+    def flush(self):
+        """Block until every queued job has run"""
+        self._queue.join()
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """The BackgroundWriter shared by every detector"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = BackgroundWriter()
+        return _writer
+
+
+_trigger_pool = None
+_trigger_pool_lock = threading.Lock()
+
+
+def get_trigger_pool():
+    """The ThreadPoolExecutor threaded triggers share"""
+    global _trigger_pool
+    with _trigger_pool_lock:
+        if _trigger_pool is None:
+            _trigger_pool = ThreadPoolExecutor(
+                max_workers=min(8, os.cpu_count() or 1) + 1,
+                thread_name_prefix='ssrlsim-trigger')
+        return _trigger_pool
+
+
+def fsync_path(path):
+    """Flush a closed file's data to disk"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)